@@ -8,6 +8,13 @@ from scipy.interpolate import UnivariateSpline
 # ------------------------
 csv_file = "./embedded/battery/readings_01.csv"  # CSV with columns: timestamp,battery
 example_voltage = 3.7     # Example battery voltage to estimate percentage
+# The CSV was recorded before calibration (twice the pin voltage), these are BATTERY_SCALING_M/Q in embedded/board/constants.h
+scaling_m = 2.1029388570527314
+scaling_q = 0.2915682666526469
+# Lookup table used by the backend (web/backend/app/battery.py)
+table_min_voltage = 3.0
+table_max_voltage = 4.2
+table_points = 25
 
 # ------------------------
 # LOAD AND PREPARE DATA
@@ -22,6 +29,9 @@ df = df.sort_values("timestamp").reset_index(drop=True)
 start_time = df["timestamp"].iloc[0]
 df["time_sec"] = (df["timestamp"] - start_time).dt.total_seconds()
 
+# Convert to the voltages reported by the calibrated firmware
+df["battery"] = scaling_m * df["battery"] / 2 + scaling_q
+
 # Normalize time: first=100%, last=0%
 t_min, t_max = df["time_sec"].iloc[0], df["time_sec"].iloc[-1]
 df["time_pct"] = 100 * (t_max - df["time_sec"]) / (t_max - t_min)
@@ -44,6 +54,15 @@ spline = UnivariateSpline(x_unique, y_unique, s=10000, k=3, ext=0)  # s is smoot
 est_pct = spline(example_voltage)
 print(f"Estimated percentage for voltage {example_voltage}V: {est_pct:.2f}%")
 
+# ------------------------
+# LOOKUP TABLE
+# ------------------------
+# Sampled at evenly spaced voltages, clipped and made monotonic so that interpolating it is well behaved
+table_voltage = np.linspace(table_min_voltage, table_max_voltage, table_points)
+table_pct = np.maximum.accumulate(np.clip(spline(table_voltage), 0, 100))
+print(f"Lookup table from {table_min_voltage}V to {table_max_voltage}V:")
+print("(" + ", ".join(f"{pct:.1f}" for pct in table_pct) + ")")
+
 # ------------------------
 # PLOT FIT
 # ------------------------
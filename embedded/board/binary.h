@@ -0,0 +1,18 @@
+#pragma once
+
+namespace gardeneye::binary {
+    // Serialize the readings to a packed little endian binary buffer
+    // The format is:
+    // ```
+    // u64 now
+    // repeated for every reading:
+    //   u64 timestamp
+    //   f32 humidity
+    //   f32 temperature
+    //   f32 battery
+    // ```
+    // The number of readings is implied by the size of the buffer
+    // Returns a pointer to a static buffer and writes its size in `len`, or nullptr on failure
+    // The function uses only stack memory
+    uint8_t *serialize_readings_to_binary_stack(size_t *len);
+}
@@ -0,0 +1,39 @@
+#include "binary.h"
+#include "types.h"
+#include "sensors.h"
+#include "timing.h"
+
+namespace gardeneye::binary {
+    uint8_t *serialize_readings_to_binary_stack(size_t *len) {
+        static uint8_t buffer[MAX_BINARY_SIZE];
+
+        // The ESP32 is little endian, so fields are copied as they are
+        size_t pos = 0;
+        uint64_t now = gardeneye::timing::get_current_timestamp();
+        memcpy(buffer + pos, &now, sizeof(now));
+        pos += sizeof(now);
+
+        struct SensorReadings* reading = nullptr;
+        uint64_t index = 0;
+        while((reading = gardeneye::sensors::iter_reading(&index)) != nullptr) {
+            if (pos + BINARY_READING_SIZE > MAX_BINARY_SIZE) {
+                Serial.println("Binary buffer overflow");
+                return nullptr;
+            }
+            float humidity = gardeneye::sensors::humidity_value(reading->humidity);
+            float temperature = gardeneye::sensors::temperature_value(reading->temperature);
+            float battery = gardeneye::sensors::battery_value(reading->battery);
+            memcpy(buffer + pos, &reading->timestamp, sizeof(reading->timestamp));
+            pos += sizeof(reading->timestamp);
+            memcpy(buffer + pos, &humidity, sizeof(humidity));
+            pos += sizeof(humidity);
+            memcpy(buffer + pos, &temperature, sizeof(temperature));
+            pos += sizeof(temperature);
+            memcpy(buffer + pos, &battery, sizeof(battery));
+            pos += sizeof(battery);
+        }
+
+        *len = pos;
+        return buffer;
+    }
+}
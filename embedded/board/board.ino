@@ -1,6 +1,7 @@
 #include "private.h"
 #include "types.h"
 #include "json.h"
+#include "binary.h"
 #include "sensors.h"
 #include "wifi.h"
 #include "constants.h"
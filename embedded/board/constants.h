@@ -23,6 +23,8 @@ constexpr uint64_t RETRY_SETUP_S = 10; // wait time before retrying first time s
 
 constexpr uint64_t MAX_JSON_SIZE = 1024 * 4; // max size of JSON payload
 constexpr uint64_t MAX_FIELD_LENGTH = 32; // max length for individual field in JSON
+constexpr uint64_t BINARY_READING_SIZE = sizeof(uint64_t) + 3 * sizeof(float); // packed size of one reading in the binary payload
+constexpr uint64_t MAX_BINARY_SIZE = sizeof(uint64_t) + MAX_SENSOR_READINGS * BINARY_READING_SIZE; // max size of binary payload
 
 constexpr float CRITICAL_V = 2.0; // critical battery voltage
 
@@ -30,4 +32,5 @@ constexpr float CRITICAL_V = 2.0; // critical battery voltage
 #define SERVER_URL "http://" SERVER_HOSTNAME
 #define READINGS_URL SERVER_URL "/api/readings"
 #define TIME_URL SERVER_URL "/api/time"
-#define REGISTER_URL SERVER_URL "/api/register"
\ No newline at end of file
+#define REGISTER_URL SERVER_URL "/api/register"
+#define READINGS_CONTENT_TYPE "application/vnd.gardeneye.readings"
\ No newline at end of file
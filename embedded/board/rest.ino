@@ -5,6 +5,7 @@
 #include "wifi.h"
 #include "rtc_data.h"
 #include "json.h"
+#include "binary.h"
 #include "sensors.h"
 
 namespace gardeneye::rest {
@@ -63,16 +64,17 @@ namespace gardeneye::rest {
         
         client.addHeader("MAC", mac_str);
         client.addHeader("Authorization", "Bearer " API_KEY);
-        client.addHeader("Content-Type", "application/json");
+        client.addHeader("Content-Type", READINGS_CONTENT_TYPE);
         
-        char* json_payload = gardeneye::json::serialize_readings_to_json_stack();
-        if (json_payload == nullptr) {
-            Serial.println("Failed to serialize JSON - buffer overflow");
+        size_t payload_len = 0;
+        uint8_t* payload = gardeneye::binary::serialize_readings_to_binary_stack(&payload_len);
+        if (payload == nullptr) {
+            Serial.println("Failed to serialize readings - buffer overflow");
             client.end();
             return false;
         }
         
-        int code = client.POST((uint8_t *)json_payload, strlen(json_payload));
+        int code = client.POST(payload, payload_len);
         if (code > 0) {
             Serial.printf("HTTP POST code: %d\n", code);
             String response = client.getString();
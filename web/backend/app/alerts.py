@@ -0,0 +1,272 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Literal, Optional
+
+import psycopg
+import psycopg.rows
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+from hub import hub
+from models import GlobalSettingsProps
+from settings import settings_cache
+
+logger = logging.getLogger(__name__)
+
+ALERT_SWEEP_S = int(os.getenv("ALERT_SWEEP_S", "30")) # how often every sensor is checked, finds the ones that stopped sending
+ALERT_TICK_S = 1.0 # how often transitions are written to the alerts table
+ALERT_MAX_PENDING = 10000 # transitions kept for a retry when they could not be written
+BATTERY_HYSTERESIS_V = float(os.getenv("BATTERY_HYSTERESIS_V", "0.05")) # volts above a threshold needed to leave its level
+
+AlertKind = Literal["offline", "battery_low", "battery_critical"]
+BatteryLevel = Literal["ok", "low", "critical"]
+
+BATTERY_ALERTS: dict[BatteryLevel, Optional[AlertKind]] = {"ok": None, "low": "battery_low", "critical": "battery_critical"}
+
+def next_battery_level(
+    previous: Optional[BatteryLevel],
+    battery: float,
+    settings: GlobalSettingsProps,
+    hysteresis: float = BATTERY_HYSTERESIS_V
+) -> BatteryLevel:
+    """
+    Get the battery level of a sensor from its latest voltage.
+    A level is only left once the voltage is clearly above the threshold that was crossed,
+    so that a voltage oscillating around a threshold does not keep raising and clearing alerts.
+    """
+    critical = settings.battery_critical_threshold
+    warning = settings.battery_warning_threshold
+    if previous == "critical":
+        critical += hysteresis
+    if previous in ("low", "critical"):
+        warning += hysteresis
+    if battery < critical:
+        return "critical"
+    if battery < warning:
+        return "low"
+    return "ok"
+
+async def fetch_alerts(
+    cur: psycopg.AsyncCursor,
+    mac: Optional[str] = None,
+    kind: Optional[AlertKind] = None,
+    active: Optional[bool] = None,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    limit: int = 100
+) -> list[dict]:
+    """
+    Get the alerts overlapping the unix timestamp bounds, latest first.
+    The cursor must use the dict row factory.
+    """
+    conditions = [sql.SQL("TRUE")]
+    if mac is not None:
+        conditions.append(sql.SQL("mac = {}").format(mac))
+    if kind is not None:
+        conditions.append(sql.SQL("kind = {}").format(kind))
+    if active is not None:
+        conditions.append(sql.SQL("ended_at IS NULL" if active else "ended_at IS NOT NULL"))
+    if start is not None:
+        conditions.append(sql.SQL("(ended_at IS NULL OR ended_at >= to_timestamp({}))").format(start))
+    if end is not None:
+        conditions.append(sql.SQL("started_at < to_timestamp({})").format(end))
+    await cur.execute(sql.SQL("""
+        SELECT id, mac, kind, value,
+            EXTRACT(EPOCH FROM started_at)::bigint AS started_at,
+            EXTRACT(EPOCH FROM ended_at)::bigint AS ended_at
+        FROM alerts
+        WHERE {conditions}
+        ORDER BY started_at DESC
+        LIMIT {limit}
+    """).format(conditions=sql.SQL(" AND ").join(conditions), limit=limit))
+    return await cur.fetchall()
+
+class SensorState:
+    __slots__ = ("online", "battery_level", "timestamp")
+
+    def __init__(self, online: bool, battery_level: Optional[BatteryLevel], timestamp: Optional[int]):
+        self.online = online
+        # None until the sensor sends its first reading
+        self.battery_level = battery_level
+        self.timestamp = timestamp
+
+class AlertEngine:
+    """
+    Tracks whether every sensor is online and its battery level, incrementally as readings are written,
+    and with a periodic sweep that finds the sensors that stopped sending.
+    Keeps the number of sensors in each condition, publishes a `status` event on every change
+    and records the alerts in the `alerts` table, one row from when a condition starts to when it ends.
+    """
+    def __init__(self):
+        self._sensors: dict[str, SensorState] = {}
+        self.counts = {"online": 0, "offline": 0, "low": 0, "critical": 0}
+        # Bumped whenever the counts change
+        self.version = 0
+        # (mac, kind, active, unix timestamp, value) waiting to be written
+        self._transitions: list[tuple[str, AlertKind, bool, int, Optional[float]]] = []
+        self._sweep_requested = True
+        self._settings_version: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pool: Optional[AsyncConnectionPool] = None
+
+    def seen(self, mac: str, timestamp: int, battery: Optional[float], record: bool = True):
+        """
+        Update a sensor with the latest reading it has just sent.
+        Transitions are only recorded by the worker that wrote the reading.
+        """
+        settings = settings_cache.cached()
+        if settings is None:
+            # The next sweep reads the thresholds from the database
+            self._sweep_requested = True
+            return
+        state = self._sensors.get(mac)
+        if state is not None and state.timestamp is not None and timestamp < state.timestamp:
+            return
+        online = int(time.time()) - timestamp <= settings.max_latency
+        level = self._level(state, battery, settings)
+        self._set(mac, online, level, timestamp, battery, record)
+
+    def request_sweep(self):
+        """
+        Check every sensor on the next tick, after sensors were added or removed.
+        """
+        self._sweep_requested = True
+
+    def _level(self, state: Optional[SensorState], battery: Optional[float], settings: GlobalSettingsProps) -> Optional[BatteryLevel]:
+        previous = state.battery_level if state is not None else None
+        if battery is None:
+            return previous
+        return next_battery_level(previous, battery, settings)
+
+    def _count(self, state: SensorState, amount: int):
+        self.counts["online" if state.online else "offline"] += amount
+        if state.battery_level in ("low", "critical"):
+            self.counts[state.battery_level] += amount
+
+    def _set(self, mac: str, online: bool, level: Optional[BatteryLevel], timestamp: Optional[int], battery: Optional[float], record: bool):
+        previous = self._sensors.get(mac)
+        if previous is not None and previous.online == online and previous.battery_level == level:
+            previous.timestamp = timestamp
+            return
+        state = SensorState(online, level, timestamp)
+        if previous is not None:
+            self._count(previous, -1)
+        self._count(state, 1)
+        self._sensors[mac] = state
+        self.version += 1
+        if previous is not None:
+            hub.publish("status", {"mac": mac, "online": online, "battery_level": level, "timestamp": timestamp})
+        if not record:
+            return
+        now = int(time.time())
+        # The first time a sensor is seen the state of every alert is written, they are idempotent
+        if previous is None or previous.online != online:
+            self._transitions.append((mac, "offline", not online, now, None))
+        if previous is None or previous.battery_level != level:
+            active = BATTERY_ALERTS[level] if level is not None else None
+            for kind in ("battery_low", "battery_critical"):
+                self._transitions.append((mac, kind, kind == active, now, battery))
+
+    def _forget(self, mac: str):
+        state = self._sensors.pop(mac)
+        self._count(state, -1)
+        self.version += 1
+
+    async def start(self, pool: AsyncConnectionPool):
+        self._pool = pool
+        try:
+            await self.sweep(pool)
+        except Exception as e:
+            logger.error(f"Error checking sensor status: {e}")
+        self._task = asyncio.create_task(self._run(pool))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._pool is not None:
+            try:
+                await self.flush(self._pool)
+            except Exception as e:
+                logger.error(f"Error writing alerts: {e}")
+
+    async def _run(self, pool: AsyncConnectionPool):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(ALERT_TICK_S)
+            try:
+                # New thresholds apply to every sensor at once
+                if self._sweep_requested or settings_cache.version != self._settings_version \
+                        or time.monotonic() - last_sweep >= ALERT_SWEEP_S:
+                    last_sweep = time.monotonic()
+                    await self.sweep(pool)
+                await self.flush(pool)
+            except Exception as e:
+                logger.error(f"Error checking sensor status: {e}")
+
+    async def sweep(self, pool: AsyncConnectionPool):
+        self._sweep_requested = False
+        self._settings_version = settings_cache.version
+        async with pool.connection() as db:
+            settings = await settings_cache.get(db)
+            async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+                await cur.execute("""
+                    SELECT s.mac, EXTRACT(EPOCH FROM l.timestamp) AS timestamp, l.battery
+                    FROM sensors s
+                    LEFT JOIN sensor_latest l ON l.mac = s.mac
+                """)
+                rows = await cur.fetchall()
+        now = int(time.time())
+        macs = set()
+        for row in rows:
+            mac = row['mac']
+            macs.add(mac)
+            timestamp = int(row['timestamp']) if row['timestamp'] is not None else None
+            online = timestamp is not None and now - timestamp <= settings.max_latency
+            # A sensor whose readings were deleted has no battery level anymore
+            level = self._level(self._sensors.get(mac), row['battery'], settings) if timestamp is not None else None
+            self._set(mac, online, level, timestamp, row['battery'], record=True)
+        # Forget deleted sensors, their alerts are deleted along with them
+        for mac in set(self._sensors) - macs:
+            self._forget(mac)
+
+    async def flush(self, pool: AsyncConnectionPool):
+        """
+        Write the pending transitions to the alerts table.
+        Every worker may detect the same transition, the partial unique index keeps one open alert per sensor and kind.
+        """
+        transitions, self._transitions = self._transitions, []
+        if not transitions:
+            return
+        try:
+            async with pool.connection() as db:
+                # In order, a sensor may have gone offline and come back since the last flush
+                async with db.pipeline(), db.cursor() as cur:
+                    for mac, kind, active, at, value in transitions:
+                        if active:
+                            # The sensor may have been deleted in the meantime
+                            await cur.execute("""
+                                INSERT INTO alerts (mac, kind, started_at, value)
+                                SELECT %s, %s, to_timestamp(%s), %s
+                                WHERE EXISTS (SELECT 1 FROM sensors WHERE mac = %s)
+                                ON CONFLICT (mac, kind) WHERE ended_at IS NULL DO NOTHING""", (mac, kind, at, value, mac))
+                        else:
+                            await cur.execute("""
+                                UPDATE alerts SET ended_at = to_timestamp(%s)
+                                WHERE mac = %s AND kind = %s AND ended_at IS NULL""", (at, mac, kind))
+        except Exception:
+            # Retried on the next tick, a restart writes the state of every alert again anyway
+            if len(transitions) + len(self._transitions) <= ALERT_MAX_PENDING:
+                self._transitions = transitions + self._transitions
+            raise
+
+    def stats(self) -> dict:
+        return {"sensors": len(self._sensors), "pending_transitions": len(self._transitions), **self.counts}
+
+alert_engine = AlertEngine()
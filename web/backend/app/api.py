@@ -1,45 +1,48 @@
+import asyncio
 import datetime
 import re
-from typing import Optional
+from typing import Literal, Optional
 import fastapi
 from fastapi import File, UploadFile, HTTPException
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import FileResponse
 import logging
 import time
 import os
-import io
-from pathlib import Path
+import uuid
 
+import numpy as np
 import psycopg
+import pydantic
 import psycopg.rows
 
-from models import InfoProps, LatestReadingProps, ReadingsProps, SensorProps, SensorSettingsProps, TimeSyncProps, GlobalSettingsProps
+from db import get_db, pool_stats
+from alerts import alert_engine, fetch_alerts
+from battery import battery_percent, battery_percent_list, battery_trends
+from compression import BodyTooLarge, UnsupportedEncoding, decode_request_body, read_request_body
+from downsample import lttb_multi
+from events import worker_events
+from export import EXTENSIONS, MEDIA_TYPES, ExportFormat, stream_export
+from hub import hub
+from jobs import job_runner
+from metrics import METRICS_CONTENT_TYPE, db_pool, db_timer, ingest_buffer, readings_uploads, registry
+from ingest import BINARY_CONTENT_TYPES, IngestBuffer, ReadingRows, decode_binary_readings, insert_readings, readings_written
+from settings import notify_settings_changed, settings_cache
+from retention import apply_retention, validate_retention
+from readings import BUCKETS, LTTB_OVERSAMPLING, MAX_POINTS, NoReadings, fetch_bounds, fetch_buckets, fetch_series, start_stream, stream_csv
+from watermark import check_etag, watermarks
+from profiler import profiler
+from photos import CONTENT_TYPE_TO_EXT, InvalidPhoto, PhotoSize, PhotoTooLarge, find_original, get_photo, hash_file, photo_cache, photo_stem, remove_photos, save_photo
+from models import AlertProps, BatchReadingsProps, ExtendedReadingsProps, InfoProps, JobAcceptedProps, JobProps, LatestReadingProps, ReadingsProps, ReadingsSeriesProps, SensorProps, SensorSettingsProps, TimeSyncProps, GlobalSettingsProps
 
 API_KEY = os.getenv("API_KEY")
 
-UPLOADS_PATH = os.getenv("UPLOADS_PATH", "/uploads")
-PHOTOS_DIR = Path(f"{UPLOADS_PATH}/photos")
-
 logger = logging.getLogger(__name__)
 
-# Ensure photos directory exists
-PHOTOS_DIR.mkdir(exist_ok=True)
-
 api = fastapi.APIRouter(prefix="/api")
 
 async def get_settings(db: psycopg.AsyncConnection) -> GlobalSettingsProps:
-    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
-        await cur.execute("SELECT key, value FROM settings")
-        rows = await cur.fetchall()
-        settings_dict = {row['key']: row['value'] for row in rows}
-        sync_time = settings_dict.get('sync-time', '12:00')
-        sync_hour, sync_minute = map(int, sync_time.split(':'))
-        return GlobalSettingsProps(
-            sync_time=(sync_hour, sync_minute),
-            battery_warning_threshold=float(settings_dict.get('battery-warning-threshold', 3.3)),
-            battery_critical_threshold=float(settings_dict.get('battery-critical-threshold', 3.0)),
-            max_latency=int(settings_dict.get('max-latency', 86400))
-        )
+    return await settings_cache.get(db)
 
 def verify_token(token: str):
     if token != API_KEY:
@@ -54,12 +57,103 @@ def verify_period(period: Optional[int]):
     if period is not None and (period <= 0 or period > time.time()):
         raise fastapi.HTTPException(status_code=400, detail="Invalid period value")
 
+def verify_range(period: Optional[int], start: Optional[int], end: Optional[int]) -> tuple[Optional[int], Optional[int]]:
+    """
+    Resolve the start and end unix timestamps of a request from either a period or explicit bounds.
+    """
+    if period is not None and start is not None:
+        raise fastapi.HTTPException(status_code=400, detail="Use either period or start, not both")
+    if period is not None:
+        start = int(time.time()) - period
+    if start is not None and end is not None and start > end:
+        raise fastapi.HTTPException(status_code=400, detail="Invalid time range")
+    return start, end
+
 @api.get("/ping", responses={200: {"description": "Pong"}})
 async def get_ping():
     return {"message": "Pong"}
 
+@api.get("/stats", responses={200: {"description": "Runtime statistics"}})
+async def get_stats(request: fastapi.Request):
+    """
+    Get runtime statistics of the backend, such as the database pool and ingest buffer usage.
+    With more than one worker, the statistics are the ones of the worker handling the request.
+    """
+    ingest: Optional[IngestBuffer] = request.app.state.ingest
+    return {
+        "worker": worker_events.stats(),
+        "alerts": alert_engine.stats(),
+        "pool": pool_stats(request.app.state.pool),
+        "ingest": ingest.stats() if ingest is not None else None,
+        "hub": hub.stats(),
+        "photos": photo_cache.stats()
+    }
+
+@api.get("/metrics", responses={200: {"description": "Metrics in the Prometheus text format", "content": {"text/plain": {}}}})
+async def get_metrics(request: fastapi.Request):
+    """
+    Expose request, query and ingest metrics in the Prometheus text format.
+    """
+    for stat, value in pool_stats(request.app.state.pool).items():
+        db_pool.set(stat, value=value)
+    ingest: Optional[IngestBuffer] = request.app.state.ingest
+    if ingest is not None:
+        for stat, value in ingest.stats().items():
+            ingest_buffer.set(stat, value=value)
+    return fastapi.Response(content=registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+def require_token(authorization: str = fastapi.Header(..., description="Bearer token for authorization")):
+    """
+    Dependency protecting the admin endpoints with the API key.
+    """
+    try:
+        scheme, token = authorization.split()
+    except ValueError:
+        raise fastapi.HTTPException(status_code=401, detail="Malformed header")
+    if scheme.lower() != "bearer":
+        raise fastapi.HTTPException(status_code=401, detail="Invalid auth scheme")
+    verify_token(token)
+
+@api.get("/admin/slow-queries", dependencies=[fastapi.Depends(require_token)], responses={
+    200: {"description": "Slow statements recorded by the profiler, newest first"},
+    401: {"description": "Unauthorized"}
+})
+async def get_slow_queries(limit: int = fastapi.Query(50, ge=1, description="Maximum number of statements returned")):
+    """
+    Get the statements slower than QUERY_PROFILER_THRESHOLD_MS, with their parameters and,
+    for a sample of the reads, their EXPLAIN (ANALYZE, BUFFERS) plan.
+    The profiler is enabled with QUERY_PROFILER_ENABLED.
+    """
+    entries = list(profiler.entries)[::-1][:limit]
+    return {**profiler.stats(), "entries": entries}
+
+@api.delete("/admin/slow-queries", dependencies=[fastapi.Depends(require_token)], responses={
+    200: {"description": "Profiler buffer cleared"},
+    401: {"description": "Unauthorized"}
+})
+async def delete_slow_queries():
+    """
+    Clear the statements recorded by the profiler.
+    """
+    profiler.clear()
+    return fastapi.Response(status_code=200)
+
+@api.get("/stream", responses={200: {"description": "Server-Sent Events stream", "content": {"text/event-stream": {}}}})
+async def get_stream():
+    """
+    Stream live events to dashboards as Server-Sent Events:
+    `readings` when a sensor uploads new readings (with its latest reading),
+    `status` when a sensor goes online or offline.
+    """
+    headers = {
+        "Cache-Control": "no-cache",
+        # Tell the proxy not to buffer the stream
+        "X-Accel-Buffering": "no"
+    }
+    return fastapi.responses.StreamingResponse(hub.stream(), media_type="text/event-stream", headers=headers)
+
 @api.post("/register", responses={200: {"description": "Success"}})
-async def post_register(request: fastapi.Request, mac: str = fastapi.Header(..., description="The MAC address of the sensor"), authorization: str = fastapi.Header(..., description="Bearer token for authorization")):
+async def post_register(db: psycopg.AsyncConnection = fastapi.Depends(get_db), mac: str = fastapi.Header(..., description="The MAC address of the sensor"), authorization: str = fastapi.Header(..., description="Bearer token for authorization")):
     """
     Endpoint to register a new sensor node.
     Does nothing if the sensor is already registered.
@@ -71,7 +165,6 @@ async def post_register(request: fastapi.Request, mac: str = fastapi.Header(...,
     if scheme.lower() != "bearer":
         raise fastapi.HTTPException(status_code=401, detail="Invalid auth scheme")
     verify_token(token)
-    db: psycopg.AsyncConnection = request.app.state.db
     if mac is None:
         return fastapi.Response(status_code=400, content="Missing X-MAC-Address header")
     # Check if MAC address is valid (basic check)
@@ -79,16 +172,62 @@ async def post_register(request: fastapi.Request, mac: str = fastapi.Header(...,
     async with db.cursor() as cur:
         await cur.execute("INSERT INTO sensors (mac) VALUES (%s) ON CONFLICT (mac) DO NOTHING", (mac,))
         await db.commit()
+    watermarks.bump([mac])
+    alert_engine.request_sweep()
     return fastapi.Response(status_code=200)
 
+async def read_readings(request: fastapi.Request) -> ReadingsProps:
+    """
+    Parse the uploaded readings, either JSON or the packed binary format depending on the Content-Type.
+    Bodies may be gzip compressed with Content-Encoding: gzip.
+    """
+    try:
+        body = decode_request_body(await read_request_body(request), request.headers.get("content-encoding"))
+    except BodyTooLarge as e:
+        raise fastapi.HTTPException(status_code=413, detail=str(e))
+    except UnsupportedEncoding as e:
+        raise fastapi.HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        # Corrupt or truncated compressed body
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    readings_uploads.inc("binary" if content_type in BINARY_CONTENT_TYPES else "json")
+    if content_type in BINARY_CONTENT_TYPES:
+        try:
+            return decode_binary_readings(body)
+        except ValueError as e:
+            raise fastapi.HTTPException(status_code=400, detail=str(e))
+    try:
+        return ReadingsProps.model_validate_json(body)
+    except pydantic.ValidationError as e:
+        raise RequestValidationError(e.errors(include_url=False), body=body)
+
 @api.post("/readings", responses={
     200: {"description": "Readings accepted"},
+    202: {"description": "Readings queued for writing"},
     400: {"description": "Invalid request"},
-    401: {"description": "Unauthorized"}
+    401: {"description": "Unauthorized"},
+    413: {"description": "Body too large, compressed or decompressed"},
+    415: {"description": "Unsupported content encoding"},
+    503: {"description": "Ingest queue full, retry later"}
+}, openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": ReadingsProps.model_json_schema()},
+            BINARY_CONTENT_TYPES[0]: {
+                "schema": {
+                    "type": "string",
+                    "format": "binary",
+                    "description": "Little endian u64 now, followed by u64 timestamp, f32 humidity, f32 temperature, f32 battery for every reading"
+                }
+            }
+        }
+    }
 })
 async def post_readings(
-    request: fastapi.Request, 
-    readings: ReadingsProps, 
+    request: fastapi.Request,
+    readings: ReadingsProps = fastapi.Depends(read_readings), 
     mac: str = fastapi.Header(..., description="The MAC address of the sensor"), 
     authorization: str = fastapi.Header(..., description="Bearer token for authorization")
 ):
@@ -103,125 +242,67 @@ async def post_readings(
         raise fastapi.HTTPException(status_code=401, detail="Invalid auth scheme")
     verify_token(token)
 
-    db: psycopg.AsyncConnection = request.app.state.db
     if mac is None:
         return fastapi.Response(status_code=400, content="Missing X-MAC-Address header")
     # Check if MAC address is valid (basic check)
     verify_mac(mac)
     # Insert readings into the database
+    rows = ReadingRows()
+    rows.add(mac, readings)
+    ingest: Optional[IngestBuffer] = request.app.state.ingest
+    if ingest is not None:
+        if not ingest.submit(rows):
+            raise fastapi.HTTPException(status_code=503, detail="Ingest queue full", headers={"Retry-After": "60"})
+        return fastapi.Response(status_code=202)
     try:
-        async with db.cursor() as cur:
-            # Make sure the sensor exists
-            await cur.execute("INSERT INTO sensors (mac) VALUES (%s) ON CONFLICT (mac) DO NOTHING", (mac,))
-            # Insert each reading
-            for i in range(len(readings.timestamps)):
-                delta_t = readings.timestamps[i] - readings.now
-                absolute_timestamp = int(time.time()) + delta_t
-                await cur.execute(
-                    """INSERT INTO readings (mac, timestamp, humidity, temperature, battery)
-                    VALUES (%s, to_timestamp(%s), %s, %s, %s)
-                    ON CONFLICT (mac, timestamp) DO NOTHING""",
-                    (mac, absolute_timestamp, readings.humidity[i], readings.temperature[i], readings.battery[i])
-                )
-        # Explicitly commit the changes
-        await db.commit()
+        # Only take a connection from the pool when writing synchronously
+        async with request.app.state.pool.connection() as db:
+            await insert_readings(db, rows)
+            # Explicitly commit the changes
+            await db.commit()
+        readings_written(rows)
     except Exception as e:
         logger.error(f"Error inserting readings: {e}")
-        # Rollback in case of error
-        await db.rollback()
         raise fastapi.HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
     return fastapi.Response(status_code=200)
 
 @api.get("/readings", responses={
-    200: {"model": ReadingsProps}, 
+    200: {"model": ReadingsSeriesProps | ExtendedReadingsProps}, 
     400: {"description": "Invalid request"}, 
     404: {"description": "No readings found"}
 })
 async def get_readings(
-    request: fastapi.Request, 
+    request: fastapi.Request,
+    response: fastapi.Response,
     mac: str = fastapi.Query(..., description="The MAC address of the sensor"),
-    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data")
+    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data"),
+    points: int = fastapi.Query(BUCKETS, ge=3, le=MAX_POINTS, description="The number of points to return"),
+    method: Literal['avg', 'lttb'] = fastapi.Query('avg', description="How points are computed: bucket averages, or Largest-Triangle-Three-Buckets downsampling of the series together"),
+    extended: bool = fastapi.Query(False, description="Also return the min, max and number of samples of each bucket (only for method=avg)")
 ):
     """
     Get sensor readings for a specific MAC address and time period.
     """
     verify_mac(mac)
     verify_period(period)
-    db: psycopg.AsyncConnection = request.app.state.db
-    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:  
-        if period is None:
-            await cur.execute(
-                """WITH bounds AS (
-                    SELECT
-                        min(timestamp) AS start_time,
-                        max(timestamp) AS end_time,
-                        count(*) AS total_points
-                    FROM readings
-                    WHERE mac = %s
-                ),
-                bucket AS (
-                    SELECT
-                        GREATEST(
-                            (EXTRACT(EPOCH FROM (end_time - start_time)) / 100)::int,
-                            1
-                        ) * INTERVAL '1 second' AS bucket_width,
-                        start_time,
-                        end_time
-                    FROM bounds
-                )
-                SELECT
-                    r.mac,
-                    EXTRACT(EPOCH FROM time_bucket(bucket.bucket_width, r.timestamp, bucket.start_time)) AS timestamp,
-                    avg(r.humidity)    AS humidity,
-                    avg(r.temperature) AS temperature,
-                    avg(r.battery)     AS battery
-                FROM readings r
-                CROSS JOIN bucket
-                WHERE r.mac = %s
-                AND r.timestamp BETWEEN bucket.start_time AND bucket.end_time
-                GROUP BY r.mac, time_bucket(bucket.bucket_width, r.timestamp, bucket.start_time)
-                ORDER BY timestamp DESC;""",
-                (mac, mac)
-            )
-        else:
-            await cur.execute(
-                """WITH bounds AS (
-                    SELECT
-                        min(timestamp) AS start_time,
-                        max(timestamp) AS end_time,
-                        count(*) AS total_points
-                    FROM readings
-                    WHERE mac = %s
-                    AND timestamp >= to_timestamp(%s)
-                ),
-                bucket AS (
-                    SELECT
-                        GREATEST(
-                            (EXTRACT(EPOCH FROM (end_time - start_time)) / 100)::int,
-                            1
-                        ) * INTERVAL '1 second' AS bucket_width,
-                        start_time,
-                        end_time
-                    FROM bounds
-                )
-                SELECT
-                    r.mac,
-                    EXTRACT(EPOCH FROM time_bucket(bucket.bucket_width, r.timestamp, bucket.start_time)) AS timestamp,
-                    avg(r.humidity)    AS humidity,
-                    avg(r.temperature) AS temperature,
-                    avg(r.battery)     AS battery
-                FROM readings r
-                CROSS JOIN bucket
-                WHERE r.mac = %s
-                AND r.timestamp BETWEEN bucket.start_time AND bucket.end_time
-                GROUP BY r.mac, time_bucket(bucket.bucket_width, r.timestamp, bucket.start_time)
-                ORDER BY timestamp DESC;
-                """,
-                (mac, int(time.time()) - period, mac)
-            )
-
-        rows = await cur.fetchall()
+    if extended and method != 'avg':
+        raise fastapi.HTTPException(status_code=400, detail="Extended readings are only available with method=avg")
+    # Before taking a connection, so that a 304 costs no trip to the database
+    not_modified = check_etag(request, response, watermarks.sensor(mac), exists=False)
+    if not_modified is not None:
+        return not_modified
+    async with request.app.state.pool.connection() as db, db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+        start = int(time.time()) - period if period is not None else None
+        bounds = await fetch_bounds(cur, mac, start)
+        if bounds is None:
+            raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address and period")
+        not_modified = check_etag(request, response, watermarks.sensor(mac))
+        if not_modified is not None:
+            return not_modified
+        if method == 'lttb':
+            return await get_readings_lttb(db, mac, *bounds, points)
+        rows = await fetch_buckets(cur, mac, *bounds, buckets=points)
         if not rows:
             raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address and period")
         timestamps = [int(row['timestamp']) for row in rows]
@@ -229,80 +310,176 @@ async def get_readings(
         temperature = [row['temperature'] for row in rows]
         battery = [row['battery'] for row in rows]
         now = int(time.time())
-        return {
+        result = {
             "timestamps": timestamps,
             "humidity": humidity,
             "temperature": temperature,
             "battery": battery,
+            "battery_percent": battery_percent_list(battery),
             "now": now
         }
+        if extended:
+            for key in ('humidity_min', 'humidity_max', 'temperature_min', 'temperature_max', 'battery_min', 'battery_max'):
+                result[key] = [row[key] for row in rows]
+            result['samples'] = [int(row['samples']) for row in rows]
+        return result
     
-@api.delete("/readings", responses={
-    200: {"description": "Readings deleted successfully"},
+def nan_to_none(values: np.ndarray) -> list[Optional[float]]:
+    return np.where(np.isnan(values), None, values).tolist()
+
+async def get_readings_lttb(
+    db: psycopg.AsyncConnection,
+    mac: str,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    points: int
+):
+    # Server side cursor, so rows are streamed into the arrays chunk by chunk
+    async with db.cursor(name="readings_series") as cur:
+        resolution = (end_time - start_time) / (points * LTTB_OVERSAMPLING)
+        series = await fetch_series(cur, mac, start_time, end_time, resolution)
+    if len(series) == 0:
+        raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address and period")
+    # Off the event loop, it takes tens of milliseconds for the largest requests
+    selected = await asyncio.to_thread(lttb_multi, series[:, 0], [series[:, 1], series[:, 2], series[:, 3]], points)
+    # Newest first, like the bucketed readings
+    series = series[selected[::-1]]
+    return {
+        "timestamps": series[:, 0].astype(np.int64).tolist(),
+        "humidity": nan_to_none(series[:, 1]),
+        "temperature": nan_to_none(series[:, 2]),
+        "battery": nan_to_none(series[:, 3]),
+        "battery_percent": nan_to_none(battery_percent(series[:, 3])),
+        "now": int(time.time())
+    }
+
+@api.get("/readings/batch", response_model=BatchReadingsProps, responses={
     400: {"description": "Invalid request"},
     404: {"description": "No readings found"}
 })
-async def delete_readings(
+async def get_readings_batch(
     request: fastapi.Request,
+    response: fastapi.Response,
+    mac: list[str] = fastapi.Query(..., description="The MAC addresses of the sensors, or `all` for every sensor"),
+    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data"),
+    start: int = fastapi.Query(None, description="Unix timestamp of the first reading to include, can't be used together with period"),
+    end: int = fastapi.Query(None, description="Unix timestamp of the last reading to include, omitting this includes the latest readings"),
+    points: int = fastapi.Query(BUCKETS, ge=3, le=MAX_POINTS, description="The number of buckets to return")
+):
+    """
+    Get the bucketed readings of several sensors at once, aligned on the same buckets.
+    """
+    macs: Optional[list[str]] = None
+    if mac != ['all']:
+        for m in mac:
+            verify_mac(m)
+        macs = sorted(set(mac))
+    verify_period(period)
+    start, end = verify_range(period, start, end)
+    # Before taking a connection, so that a 304 costs no trip to the database
+    not_modified = check_etag(request, response, watermarks.version, exists=False)
+    if not_modified is not None:
+        return not_modified
+    async with request.app.state.pool.connection() as db, db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+        bounds = await fetch_bounds(cur, macs, start, end)
+        if bounds is None:
+            raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC addresses and period")
+        not_modified = check_etag(request, response, watermarks.version)
+        if not_modified is not None:
+            return not_modified
+        rows = await fetch_buckets(cur, macs, *bounds, buckets=points)
+    # Rows are sorted newest first, so buckets are indexed in order of appearance
+    bucket_index: dict[int, int] = {}
+    for row in rows:
+        bucket_index.setdefault(int(row['timestamp']), len(bucket_index))
+    sensors = sorted({row['mac'] for row in rows})
+    sensor_index = {m: i for i, m in enumerate(sensors)}
+    humidity = [[None] * len(bucket_index) for _ in sensors]
+    temperature = [[None] * len(bucket_index) for _ in sensors]
+    battery = [[None] * len(bucket_index) for _ in sensors]
+    for row in rows:
+        i = sensor_index[row['mac']]
+        j = bucket_index[int(row['timestamp'])]
+        humidity[i][j] = row['humidity']
+        temperature[i][j] = row['temperature']
+        battery[i][j] = row['battery']
+    return BatchReadingsProps(
+        sensors=sensors,
+        timestamps=list(bucket_index),
+        humidity=humidity,
+        temperature=temperature,
+        battery=battery,
+        battery_percent=[battery_percent_list(values) for values in battery],
+        now=int(time.time())
+    )
+
+@api.delete("/readings", status_code=202, response_model=JobAcceptedProps, responses={
+    202: {"description": "Deletion queued, its progress is reported at `status_url`"},
+    400: {"description": "Invalid request"},
+    404: {"description": "No readings found"}
+})
+async def delete_readings(
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
     mac: str = fastapi.Query(..., description="The MAC address of the sensor")
 ):
     """
-    Delete all readings for a specific MAC address.
+    Delete all readings for a specific MAC address, rollups included.
+    The readings are deleted in the background, one chunk at a time.
     """
     verify_mac(mac)
-    db: psycopg.AsyncConnection = request.app.state.db
-    async with db.cursor() as cur:
-        await cur.execute("SELECT 1 FROM readings WHERE mac = %s LIMIT 1", (mac,))
-        if await cur.fetchone() is None:
+    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+        if await fetch_bounds(cur, mac) is None:
             raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address")
-        await cur.execute("DELETE FROM readings WHERE mac = %s", (mac,))
-        await db.commit()
-    return fastapi.Response(status_code=200)
+    job_id = await job_runner.submit(db, "delete_readings", mac)
+    return JobAcceptedProps(job_id=job_id, status_url=f"/api/jobs/{job_id}")
 
 @api.get(f"/sensors", response_model=list[SensorProps] | SensorProps)
 async def get_sensors(
     request: fastapi.Request,
+    response: fastapi.Response,
     mac: Optional[str] = fastapi.Query(None, description="The MAC address of the sensor to filter by")
 ):
     """
     Get all sensors with their latest readings (if available).
     """
-    db: psycopg.AsyncConnection = request.app.state.db
-    settings = await get_settings(db)
-    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
-        if mac:
-            verify_mac(mac)
-            await cur.execute("""
-                SELECT s.mac, s.name, s.has_photo,
-                       EXTRACT(EPOCH FROM r.timestamp) AS timestamp, 
-                       r.humidity, r.temperature, r.battery
-                FROM sensors s
-                LEFT JOIN LATERAL (
-                    SELECT * FROM readings 
-                    WHERE readings.mac = s.mac 
-                    ORDER BY readings.timestamp DESC 
-                    LIMIT 1
-                ) r ON true
-                WHERE s.mac = %s
-                ORDER BY s.mac
-            """, (mac,))
-        else:
-            await cur.execute("""
-                SELECT s.mac, s.name, s.has_photo,
-                    EXTRACT(EPOCH FROM r.timestamp) AS timestamp, 
-                    r.humidity, r.temperature, r.battery
-                FROM sensors s
-                LEFT JOIN LATERAL (
-                    SELECT * FROM readings 
-                    WHERE readings.mac = s.mac 
-                    ORDER BY readings.timestamp DESC 
-                    LIMIT 1
-                ) r ON true
-                ORDER BY s.mac
-            """)
-        rows = await cur.fetchall()
+    if mac:
+        verify_mac(mac)
+    version = watermarks.sensor(mac) if mac else watermarks.version
+    # Before taking a connection, so that a 304 costs no trip to the database; the list always exists, a sensor may not
+    not_modified = check_etag(request, response, version, settings_cache.version, exists=not mac)
+    if not_modified is not None:
+        return not_modified
+    async with request.app.state.pool.connection() as db, db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+        settings = await get_settings(db)
+        with db_timer("latest_reading"):
+            if mac:
+                await cur.execute("""
+                    SELECT s.mac, s.name, s.has_photo, s.photo_hash,
+                           EXTRACT(EPOCH FROM r.timestamp) AS timestamp, 
+                           r.humidity, r.temperature, r.battery
+                    FROM sensors s
+                    LEFT JOIN sensor_latest r ON r.mac = s.mac
+                    WHERE s.mac = %s
+                    ORDER BY s.mac
+                """, (mac,))
+            else:
+                await cur.execute("""
+                    SELECT s.mac, s.name, s.has_photo, s.photo_hash,
+                        EXTRACT(EPOCH FROM r.timestamp) AS timestamp, 
+                        r.humidity, r.temperature, r.battery
+                    FROM sensors s
+                    LEFT JOIN sensor_latest r ON r.mac = s.mac
+                    ORDER BY s.mac
+                """)
+            rows = await cur.fetchall()
+        if mac and rows:
+            not_modified = check_etag(request, response, version, settings_cache.version)
+            if not_modified is not None:
+                return not_modified
+        # Estimated for every sensor at once
+        percents = battery_percent_list([row['battery'] if row['timestamp'] is not None else None for row in rows])
         result = []
-        for row in rows:
+        for row, percent in zip(rows, percents):
             latest_reading = None
             if row['timestamp'] is not None:
                 latest_reading = LatestReadingProps(
@@ -316,8 +493,11 @@ async def get_sensors(
                 mac=row['mac'],
                 name=row['name'],
                 has_photo=row['has_photo'],
+                photo_hash=row['photo_hash'],
                 online=(int(time.time()) - int(row['timestamp']) <= settings.max_latency) if row['timestamp'] is not None else False,
-                latest_reading=latest_reading
+                latest_reading=latest_reading,
+                battery_percent=percent,
+                battery_time_to_empty=battery_trends.time_to_empty(row['mac'], percent)
             ))
         if mac is not None and len(result) == 0:
             return fastapi.Response(status_code=404, content="Sensor not found")
@@ -326,37 +506,46 @@ async def get_sensors(
         else:
             return result
 
-@api.delete("/sensors/{mac}", responses={
-    200: {"description": "Sensor deleted successfully"},
+@api.delete("/sensors/{mac}", status_code=202, response_model=JobAcceptedProps, responses={
+    202: {"description": "Deletion queued, its progress is reported at `status_url`"},
     404: {"description": "Sensor not found"}
 })
 async def delete_sensor(
-    request: fastapi.Request,
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
     mac: str = fastapi.Path(..., description="The MAC address of the sensor to delete")
 ):
     """
-    Delete a specific sensor and all its associated readings.
+    Delete a specific sensor, its photo and all its associated readings.
+    The readings are deleted in the background, one chunk at a time, then the sensor itself.
     """
     verify_mac(mac)
-    db: psycopg.AsyncConnection = request.app.state.db
     async with db.cursor() as cur:
-        await cur.execute("SELECT 1 FROM sensors WHERE mac = %s LIMIT 1", (mac,))
+        await cur.execute("SELECT 1 FROM sensors WHERE mac = %s", (mac,))
         if await cur.fetchone() is None:
             raise fastapi.HTTPException(status_code=404, detail="Sensor not found")
-        # Delete associated photo if it exists
-        mac_clean = mac.replace(":", "").lower()
-        for photo_file in PHOTOS_DIR.glob(f"{mac_clean}.*"):
-            photo_file.unlink()
-        await cur.execute("DELETE FROM sensors WHERE mac = %s", (mac,))
-        # Cascade delete will remove associated readings
-        await db.commit()
-    return fastapi.Response(status_code=200)
+    job_id = await job_runner.submit(db, "delete_sensor", mac)
+    return JobAcceptedProps(job_id=job_id, status_url=f"/api/jobs/{job_id}")
+
+@api.get("/jobs/{job_id}", response_model=JobProps, responses={
+    404: {"description": "Job not found"}
+})
+async def get_job(
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
+    job_id: uuid.UUID = fastapi.Path(..., description="The id returned when the job was queued")
+):
+    """
+    Get the status and progress of a background job.
+    """
+    job = await job_runner.get(db, str(job_id))
+    if job is None:
+        raise fastapi.HTTPException(status_code=404, detail="Job not found")
+    return JobProps(**job)
 
 @api.post(
     "/sensors/{mac}/settings",      
 )
 async def post_sensor_settings(
-    request: fastapi.Request,
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
     mac: str = fastapi.Path(..., description="The MAC address of the sensor"),
     settings: SensorSettingsProps = fastapi.Body(..., description="The sensor settings to update")
 ):
@@ -364,7 +553,6 @@ async def post_sensor_settings(
     Update settings for a specific sensor.
     """
     verify_mac(mac)
-    db: psycopg.AsyncConnection = request.app.state.db
     async with db.cursor() as cur:
         # Check if sensor exists
         await cur.execute("SELECT mac FROM sensors WHERE mac = %s", (mac,))
@@ -375,95 +563,85 @@ async def post_sensor_settings(
         await cur.execute("UPDATE sensors SET name = %s WHERE mac = %s", (settings.name, mac))
         
         await db.commit()
+    watermarks.bump([mac])
 
     return fastapi.Response(status_code=200)
 
 @api.get(f"/info", response_model=list[InfoProps])
-async def get_info(request: fastapi.Request):
+async def get_info(request: fastapi.Request, response: fastapi.Response):
     """
     Get information about the system.
+    The counts are kept up to date by the alert engine, as readings arrive and sensors stop sending.
     """
+    not_modified = check_etag(request, response, alert_engine.version)
+    if not_modified is not None:
+        return not_modified
+    counts = alert_engine.counts
     result = []
-    db: psycopg.AsyncConnection = request.app.state.db
-    settings = await get_settings(db)
+    if counts["online"] > 0:
+        result.append(InfoProps(
+            title="Online Sensors",
+            content=str(counts["online"]),
+            level="info"))
+    if counts["offline"] > 0:
+        result.append(InfoProps(
+            title="Offline Sensors",
+            content=str(counts["offline"]),
+            level="error"))
+    if counts["low"] > 0:
+        result.append(InfoProps(
+            title="Low Battery Sensors",
+            content=str(counts["low"]),
+            level="warning"))
+    if counts["critical"] > 0:
+        result.append(InfoProps(
+            title="Critical Battery Sensors",
+            content=str(counts["critical"]),
+            level="error"))
+    return result
+
+@api.get("/alerts", response_model=list[AlertProps])
+async def get_alerts(
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
+    mac: Optional[str] = fastapi.Query(None, description="The MAC address of the sensor to filter by"),
+    kind: Optional[Literal["offline", "battery_low", "battery_critical"]] = fastapi.Query(None, description="The kind of alert to filter by"),
+    active: Optional[bool] = fastapi.Query(None, description="Only active (true) or ended (false) alerts"),
+    start: Optional[int] = fastapi.Query(None, description="Only alerts still active after this unix timestamp"),
+    end: Optional[int] = fastapi.Query(None, description="Only alerts started before this unix timestamp"),
+    limit: int = fastapi.Query(100, ge=1, le=1000, description="Maximum number of alerts, latest first")
+):
+    """
+    Get the alert history, latest first.
+    """
+    if mac is not None:
+        verify_mac(mac)
+    start, end = verify_range(None, start, end)
     async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
-        online_sensors = 0
-        offline_sensors = 0
-        low_battery_nodes = 0
-        critical_battery_nodes = 0
-        
-        # Get latest info for each sensor
-        await cur.execute("""
-            SELECT s.mac, s.name, s.has_photo,
-                    EXTRACT(EPOCH FROM r.timestamp) AS timestamp, 
-                    r.humidity, r.temperature, r.battery
-                FROM sensors s
-                LEFT JOIN LATERAL (
-                    SELECT * FROM readings 
-                    WHERE readings.mac = s.mac 
-                    ORDER BY readings.timestamp DESC 
-                    LIMIT 1
-                ) r ON true
-                ORDER BY s.mac
-        """)
-        latest_readings = await cur.fetchall()
-        for row in latest_readings:
-            if row['timestamp'] is not None:
-                if int(time.time()) - int(row['timestamp']) <= settings.max_latency:
-                    online_sensors += 1
-                else:
-                    offline_sensors += 1
-                
-                if row['battery'] < settings.battery_critical_threshold:
-                    critical_battery_nodes += 1
-                elif row['battery'] < settings.battery_warning_threshold:
-                    low_battery_nodes += 1
-            else:
-                offline_sensors += 1  # No readings means offline
-        if online_sensors > 0:
-            result.append(InfoProps(
-                title="Online Sensors",
-                content=str(online_sensors),
-                level="info"))
-        if offline_sensors > 0:
-            result.append(InfoProps(
-                title="Offline Sensors",
-                content=str(offline_sensors),
-                level="error"))
-        if low_battery_nodes > 0:
-            result.append(InfoProps(
-                title="Low Battery Sensors",
-                content=str(low_battery_nodes),
-                level="warning"))
-        if critical_battery_nodes > 0:
-            result.append(InfoProps(
-                title="Critical Battery Sensors",
-                content=str(critical_battery_nodes),
-                level="error"))
-        return result
+        rows = await fetch_alerts(cur, mac, kind, active, start, end, limit)
+    return [AlertProps(**row) for row in rows]
 
 @api.post("/sensors/{mac}/photo", responses={
     200: {"description": "Photo uploaded successfully"},
     400: {"description": "Invalid request or file format"},
-    404: {"description": "Sensor not found"}
+    404: {"description": "Sensor not found"},
+    413: {"description": "Photo too large"}
 })
 async def upload_sensor_photo(
-    request: fastapi.Request,
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
     mac: str = fastapi.Path(..., description="The MAC address of the sensor"),
     photo: UploadFile = File(..., description="The photo file to upload"),
 ):
     """
     Upload a photo for a specific sensor.
+    The photo is streamed to disk and resized thumbnail and card variants are generated from it.
     """
     verify_mac(mac)
-    og_mac = mac
-    mac = mac.replace(":", "").lower()
 
     # Check if sensor exists
-    db: psycopg.AsyncConnection = request.app.state.db
     async with db.cursor() as cur:
-        await cur.execute("SELECT mac FROM sensors WHERE mac = %s", (og_mac,))
-        if await cur.fetchone() is None:
+        await cur.execute("SELECT photo_ext FROM sensors WHERE mac = %s", (mac,))
+        sensor = await cur.fetchone()
+        if sensor is None:
             raise HTTPException(status_code=404, detail="Sensor not found")
 
     # Validate file type
@@ -471,114 +649,134 @@ async def upload_sensor_photo(
         raise HTTPException(status_code=400, detail="File must be an image")
 
     # Get file extension from content type
-    content_type_to_ext = {
-        'image/jpeg': '.jpg',
-        'image/jpg': '.jpg',
-        'image/png': '.png',
-        'image/webp': '.webp',
-        'image/gif': '.gif'
-    }
-    
-    file_ext = content_type_to_ext.get(photo.content_type)
+    file_ext = CONTENT_TYPE_TO_EXT.get(photo.content_type)
     if not file_ext:
         raise HTTPException(status_code=400, detail="Unsupported image format")
 
-    # Save file with MAC address as filename
-    filename = f"{mac}{file_ext}"
-    file_path = PHOTOS_DIR / filename
-
     try:
-        # Remove existing photo if it exists
-        for existing_file in PHOTOS_DIR.glob(f"{mac}.*"):
-            existing_file.unlink()
-
-        # Save new photo
-        with open(file_path, "wb") as buffer:
-            content = await photo.read()
-            buffer.write(content)
+        photo_hash = await save_photo(mac, photo, file_ext, previous_ext=sensor[0])
+    except PhotoTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidPhoto as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error uploading photo for sensor {mac}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to upload photo")
 
+    try:
         # Update database to set has_photo = true
         async with db.cursor() as cur:
-            await cur.execute("UPDATE sensors SET has_photo = true WHERE mac = %s", (og_mac,))
+            await cur.execute(
+                "UPDATE sensors SET has_photo = true, photo_ext = %s, photo_hash = %s WHERE mac = %s",
+                (file_ext, photo_hash, mac))
             await db.commit()
+        watermarks.bump([mac])
 
-        return {"message": "Photo uploaded successfully", "filename": filename}
+        return {"message": "Photo uploaded successfully", "filename": f"{photo_stem(mac)}{file_ext}", "hash": photo_hash}
 
     except Exception as e:
-        logger.error(f"Error uploading photo for sensor {og_mac}: {e}")
+        logger.error(f"Error uploading photo for sensor {mac}: {e}")
         raise HTTPException(status_code=500, detail="Failed to upload photo")
 
+async def get_photo_meta(db: psycopg.AsyncConnection, mac: str) -> Optional[tuple[str, str]]:
+    """
+    Extension and content hash of a sensor's photo, None if it has no photo.
+    Photos uploaded before they were recorded in the database are looked up once and recorded.
+    """
+    async with db.cursor() as cur:
+        await cur.execute("SELECT has_photo, photo_ext, photo_hash FROM sensors WHERE mac = %s", (mac,))
+        row = await cur.fetchone()
+        if row is None or not row[0]:
+            return None
+        has_photo, photo_ext, photo_hash = row
+        if photo_ext is not None and photo_hash is not None:
+            return photo_ext, photo_hash
+        path = await asyncio.to_thread(find_original, mac)
+        if path is None:
+            return None
+        photo_ext, photo_hash = path.suffix.lower(), await asyncio.to_thread(hash_file, path)
+        await cur.execute(
+            "UPDATE sensors SET photo_ext = %s, photo_hash = %s WHERE mac = %s",
+            (photo_ext, photo_hash, mac))
+        await db.commit()
+    return photo_ext, photo_hash
+
 @api.get("/sensors/{mac}/photo", responses={
     200: {"description": "Photo file", "content": {"image/*": {}}},
+    304: {"description": "Not modified"},
     404: {"description": "Photo not found"}
 })
-async def get_sensor_photo(mac: str):
+async def get_sensor_photo(
+    request: fastapi.Request,
+    mac: str,
+    size: PhotoSize = fastapi.Query("original", description="thumb and card are WebP variants resized for the dashboard"),
+    v: Optional[str] = fastapi.Query(None, description="Content hash of the photo, makes the response cacheable forever"),
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
+):
     """
     Get the photo for a specific sensor.
     """
     verify_mac(mac)
-    mac = mac.replace(":", "").lower()
 
-    # Find photo file for this MAC address
-    photo_files = list(PHOTOS_DIR.glob(f"{mac}.*"))
-    
-    if not photo_files:
+    meta = await get_photo_meta(db, mac)
+    if meta is None:
         raise HTTPException(status_code=404, detail="Photo not found")
+    photo_ext, photo_hash = meta
 
-    photo_path = photo_files[0]  # Take the first match
-    
-    if not photo_path.exists():
-        raise HTTPException(status_code=404, detail="Photo file not found")
-
-    # Determine media type from file extension
-    ext_to_media_type = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg', 
-        '.png': 'image/png',
-        '.webp': 'image/webp',
-        '.gif': 'image/gif'
+    headers = {
+        "ETag": f'"{photo_hash}-{size}"',
+        # Hash versioned URLs never change, the others must be revalidated
+        "Cache-Control": "public, max-age=31536000, immutable" if v == photo_hash else "no-cache",
     }
-    
-    media_type = ext_to_media_type.get(photo_path.suffix.lower(), 'image/jpeg')
-    
-    return FileResponse(photo_path, media_type=media_type)
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return fastapi.Response(status_code=304, headers=headers)
+
+    try:
+        photo_path, media_type, data = await get_photo(mac, photo_ext, photo_hash, size)
+    except InvalidPhoto as e:
+        logger.error(f"Error resizing photo for sensor {mac}: {e}")
+        photo_path, media_type, data = await get_photo(mac, photo_ext, photo_hash, "original")
+        headers["Cache-Control"] = "no-cache"
+    if data is not None:
+        return fastapi.Response(content=data, media_type=media_type, headers=headers)
+    return FileResponse(photo_path, media_type=media_type, headers=headers)
 
 @api.delete("/sensors/{mac}/photo", responses={
     200: {"description": "Photo deleted successfully"},
     404: {"description": "Photo not found"}
 })
 async def delete_sensor_photo(
-    request: fastapi.Request,
     mac: str,
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
 ):
     """
     Delete the photo for a specific sensor.
     """
     verify_mac(mac)
-    og_mac = mac
-    mac = mac.replace(":", "").lower()
 
-    # Find and delete photo file
-    photo_files = list(PHOTOS_DIR.glob(f"{mac}.*"))
-    
-    if not photo_files:
+    async with db.cursor() as cur:
+        await cur.execute("SELECT has_photo, photo_ext FROM sensors WHERE mac = %s", (mac,))
+        sensor = await cur.fetchone()
+    if sensor is None or not sensor[0]:
         raise HTTPException(status_code=404, detail="Photo not found")
 
     try:
-        # Delete all photo files for this MAC (in case there are multiple)
-        for photo_path in photo_files:
-            photo_path.unlink()
+        # Delete the photo along with its resized variants
+        await asyncio.to_thread(remove_photos, mac, sensor[1])
 
         # Update database to set has_photo = false
-        db: psycopg.AsyncConnection = request.app.state.db
         async with db.cursor() as cur:
-            await cur.execute("UPDATE sensors SET has_photo = false WHERE mac = %s", (og_mac,))
+            await cur.execute(
+                "UPDATE sensors SET has_photo = false, photo_ext = NULL, photo_hash = NULL WHERE mac = %s",
+                (mac,))
             await db.commit()
+        watermarks.bump([mac])
 
         return {"message": "Photo deleted successfully"}
 
     except Exception as e:
-        logger.error(f"Error deleting photo for sensor {og_mac}: {e}")
+        logger.error(f"Error deleting photo for sensor {mac}: {e}")
         raise HTTPException(status_code=500, detail="Failed to delete photo")
     
 @api.get("/readings/download", responses={
@@ -588,46 +786,66 @@ async def delete_sensor_photo(
 async def get_readings_download(
     request: fastapi.Request,
     mac: str = fastapi.Query(..., description="The MAC address of the sensor"),
-    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data")
+    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data"),
+    start: int = fastapi.Query(None, description="Unix timestamp of the first reading to include, can't be used together with period"),
+    end: int = fastapi.Query(None, description="Unix timestamp of the last reading to include, omitting this includes the latest readings")
 ):
     """
     Download sensor readings as a CSV file for a specific MAC address and time period.
+    The file is streamed straight from the database, so memory usage does not depend on its size.
     """
     verify_mac(mac)
     verify_period(period)
-    db: psycopg.AsyncConnection = request.app.state.db
-    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:  
-        if period is None:
-            await cur.execute(
-                """SELECT mac, to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') as timestamp, humidity, temperature, battery 
-                   FROM readings 
-                   WHERE mac = %s
-                   ORDER BY timestamp DESC""",
-                (mac,)
-            )
-        else:
-            await cur.execute(
-                """SELECT mac, to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') as timestamp, humidity, temperature, battery 
-                   FROM readings 
-                   WHERE mac = %s AND timestamp >= to_timestamp(%s)
-                   ORDER BY timestamp DESC""",
-                (mac, int(time.time()) - period)
-            )
-
-        rows = await cur.fetchall()
-        if not rows:
-            raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address and period")
-        
-        # Create CSV content
-        csv_content = "mac,timestamp,humidity,temperature,battery\n"
-        for row in rows:
-            csv_content += f"{row['mac']},{row['timestamp']},{row['humidity']},{row['temperature']},{row['battery']}\n"
-        
-        io_stream = io.StringIO(csv_content)
-        headers = {
-            'Content-Disposition': f'attachment; filename="{mac.replace(":", "").lower()}_readings.csv"'
-        }
-        return fastapi.responses.StreamingResponse(io_stream, media_type="text/csv", headers=headers)
+    start, end = verify_range(period, start, end)
+    # The readings are looked up on the connection of the stream, which is only held while streaming
+    try:
+        stream = await start_stream(stream_csv(request.app.state.pool, mac, start, end))
+    except NoReadings:
+        raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC address and period")
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="{mac.replace(":", "").lower()}_readings.csv"'
+    }
+    return fastapi.responses.StreamingResponse(
+        stream,
+        media_type="text/csv",
+        headers=headers
+    )
+
+@api.get("/readings/export", responses={
+    200: {"description": "Parquet file or Arrow IPC stream", "content": {MEDIA_TYPES["parquet"]: {}, MEDIA_TYPES["arrow"]: {}}},
+    400: {"description": "Invalid request"},
+    404: {"description": "No readings found"}})
+async def get_readings_export(
+    request: fastapi.Request,
+    mac: list[str] = fastapi.Query(..., description="The MAC addresses of the sensors to export"),
+    format: ExportFormat = fastapi.Query("parquet", description="The output format"),
+    period: int = fastapi.Query(None, description="The time period in seconds to look back from the current time, omitting this retrieves all available data"),
+    start: int = fastapi.Query(None, description="Unix timestamp of the first reading to include, can't be used together with period"),
+    end: int = fastapi.Query(None, description="Unix timestamp of the last reading to include, omitting this includes the latest readings")
+):
+    """
+    Download the readings of several sensors in a columnar format (Parquet or Arrow IPC stream).
+    """
+    for m in mac:
+        verify_mac(m)
+    verify_period(period)
+    start, end = verify_range(period, start, end)
+    macs = sorted(set(mac))
+    # The readings are looked up on the connection of the stream, which is only held while streaming
+    try:
+        stream = await start_stream(stream_export(request.app.state.pool, macs, format, start, end))
+    except NoReadings:
+        raise fastapi.HTTPException(status_code=404, detail="No readings found for the specified MAC addresses and period")
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="readings.{EXTENSIONS[format]}"'
+    }
+    return fastapi.responses.StreamingResponse(
+        stream,
+        media_type=MEDIA_TYPES[format],
+        headers=headers
+    )
 
 @api.get("/time", response_model=TimeSyncProps)
 async def get_time(
@@ -636,8 +854,7 @@ async def get_time(
     """
     Get the current server time and the next recommended sync time.
     """
-    db: psycopg.AsyncConnection = request.app.state.db
-    settings = await get_settings(db)
+    settings = await settings_cache.get_pooled(request.app.state.pool)
     base_time = int(time.time())
     next_sync = datetime.datetime.now()
     hour, minute = settings.sync_time
@@ -656,23 +873,32 @@ async def get_global_settings(
     """
     Get global settings.
     """
-    db: psycopg.AsyncConnection = request.app.state.db
-    settings = await get_settings(db)
+    settings = await settings_cache.get_pooled(request.app.state.pool)
     return settings
 
-@api.post("/settings", responses={200: {"description": "Settings updated successfully"}})
+@api.post("/settings", responses={
+    200: {"description": "Settings updated successfully"},
+    400: {"description": "Invalid retention tiers"}
+})
 async def post_global_settings(
-    request: fastapi.Request,
+    db: psycopg.AsyncConnection = fastapi.Depends(get_db),
     settings: GlobalSettingsProps = fastapi.Body(..., description="The global settings to update")
 ):
     """
     Update global settings.
+    Changing the retention tiers replaces the retention policies, older chunks are dropped in the background.
     """
-    db: psycopg.AsyncConnection = request.app.state.db
+    try:
+        validate_retention(settings)
+    except ValueError as e:
+        raise fastapi.HTTPException(status_code=400, detail=str(e))
     async with db.cursor() as cur:
         await cur.execute("UPDATE settings SET value = %s WHERE key = 'sync-time'", (f"{settings.sync_time[0]:02}:{settings.sync_time[1]:02}",))
         await cur.execute("UPDATE settings SET value = %s WHERE key = 'battery-warning-threshold'", (str(settings.battery_warning_threshold),))
         await cur.execute("UPDATE settings SET value = %s WHERE key = 'battery-critical-threshold'", (str(settings.battery_critical_threshold),))
         await cur.execute("UPDATE settings SET value = %s WHERE key = 'max-latency'", (str(settings.max_latency),))
+        await apply_retention(db, settings)
+        await notify_settings_changed(db)
         await db.commit()
+    settings_cache.invalidate()
     return fastapi.Response(status_code=200)
\ No newline at end of file
@@ -1,26 +1,52 @@
 import fastapi
 from fastapi.concurrency import asynccontextmanager
-import psycopg
-import os
 import logging
 from api import api
+from compression import CompressionMiddleware
+from metrics import MetricsMiddleware
+from db import create_pool
+from events import worker_events
+from alerts import alert_engine
+from battery import battery_trends
+from jobs import job_runner
+from profiler import QUERY_PROFILER_ENABLED, profiler
+from ingest import INGEST_BUFFER_ENABLED, IngestBuffer
+from settings import settings_cache
 
 logger = logging.getLogger(__name__)
 
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_USER = os.getenv("DB_USER", "root")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
-
 @asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
-    app.state.db = await psycopg.AsyncConnection.connect(
-        f"host={DB_HOST} port={DB_PORT} user={DB_USER} password={DB_PASSWORD}"
-    )
-    logger.info("Database connection established.")
+    app.state.pool = create_pool()
+    await app.state.pool.open(wait=True)
+    logger.info("Database connection pool opened.")
+    if QUERY_PROFILER_ENABLED:
+        profiler.start(app.state.pool)
+        logger.info("Slow query profiler enabled.")
+    await settings_cache.start()
+    await worker_events.start(app.state.pool)
+    await alert_engine.start(app.state.pool)
+    await battery_trends.load(app.state.pool)
+    await job_runner.start(app.state.pool)
+    app.state.ingest = None
+    if INGEST_BUFFER_ENABLED:
+        app.state.ingest = IngestBuffer(app.state.pool)
+        await app.state.ingest.start()
+        logger.info("Ingest buffer started.")
     yield
-    await app.state.db.close()
-    logger.info("Database connection closed.")
+    if app.state.ingest is not None:
+        await app.state.ingest.stop()
+        logger.info("Ingest buffer flushed and stopped.")
+    await job_runner.stop()
+    await alert_engine.stop()
+    await worker_events.stop()
+    await settings_cache.stop()
+    await profiler.stop()
+    await app.state.pool.close()
+    logger.info("Database connection pool closed.")
 
 app = fastapi.FastAPI(lifespan=lifespan, docs_url="/api/docs", redoc_url="/api/redoc", openapi_url="/api/openapi.json")
-app.include_router(api)
\ No newline at end of file
+app.add_middleware(CompressionMiddleware)
+# Added last so it wraps the compression and measures the bytes actually sent
+app.add_middleware(MetricsMiddleware)
+app.include_router(api)
@@ -0,0 +1,131 @@
+import logging
+import os
+from collections import deque
+from typing import Optional
+
+import numpy as np
+import psycopg.rows
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+BATTERY_TREND_WINDOW_S = int(os.getenv("BATTERY_TREND_WINDOW_S", "21600")) # readings the discharge rate is fitted on, 6 hours
+BATTERY_TREND_MIN_SPAN_S = 3600 # no time to empty until the readings span at least this long
+BATTERY_TREND_MIN_SAMPLES = 3
+BATTERY_TREND_MAX_SAMPLES = 512 # per sensor, older samples are dropped first
+BATTERY_TREND_SEED_BUCKET = "10 minutes" # resolution of the history loaded at startup
+
+# Remaining charge (%) of a cell at evenly spaced voltages from BATTERY_CURVE_MIN_V to BATTERY_CURVE_MAX_V,
+# sampled from the spline fitted by embedded/battery/regress.py on a full discharge
+BATTERY_CURVE_MIN_V = 3.0
+BATTERY_CURVE_MAX_V = 4.2
+BATTERY_CURVE_PERCENT = np.array([
+    0.0, 0.2, 1.1, 1.4, 1.5, 1.6, 2.0, 2.8, 4.4, 7.0, 10.7, 15.3, 20.2,
+    25.0, 29.2, 32.5, 36.0, 41.8, 50.2, 58.7, 65.8, 74.1, 85.6, 97.0, 99.9,
+])
+BATTERY_CURVE_VOLTS = np.linspace(BATTERY_CURVE_MIN_V, BATTERY_CURVE_MAX_V, len(BATTERY_CURVE_PERCENT))
+
+def battery_percent(volts: np.ndarray) -> np.ndarray:
+    """
+    Estimate the remaining charge (%) of the cells from their voltages, NaN stays NaN.
+    Voltages outside of the curve are clamped to 0% and 100%.
+    """
+    volts = np.asarray(volts, dtype=np.float64)
+    percent = np.interp(volts, BATTERY_CURVE_VOLTS, BATTERY_CURVE_PERCENT)
+    return np.round(np.where(np.isnan(volts), np.nan, percent), 1)
+
+def battery_percent_list(volts: list[Optional[float]]) -> list[Optional[float]]:
+    """
+    Same as `battery_percent` for a list where missing values are None.
+    """
+    percent = battery_percent(np.array(volts, dtype=np.float64))
+    return np.where(np.isnan(percent), None, percent).tolist()
+
+class BatteryTrends:
+    """
+    Rolling least squares slope of the charge of every sensor over the last BATTERY_TREND_WINDOW_S,
+    kept up to date as readings are written. The running sums make every update and query O(1).
+    """
+    def __init__(self, window_s: int = BATTERY_TREND_WINDOW_S):
+        self.window_s = window_s
+        # mac -> samples (timestamp, percent) and running sums [n, Σt, Σp, Σtt, Σtp]
+        # Timestamps are relative to the first sample of the sensor, to keep the sums precise
+        self._samples: dict[str, deque[tuple[int, float]]] = {}
+        self._sums: dict[str, list[float]] = {}
+        self._origin: dict[str, int] = {}
+
+    def add(self, mac: str, timestamp: int, battery: Optional[float]):
+        if battery is None:
+            return
+        samples = self._samples.get(mac)
+        if samples is None:
+            samples = self._samples[mac] = deque()
+            self._sums[mac] = [0.0] * 5
+            self._origin[mac] = timestamp
+        elif samples and timestamp <= samples[-1][0]:
+            return
+        percent = float(battery_percent(battery))
+        sums = self._sums[mac]
+        samples.append((timestamp, percent))
+        self._update(sums, timestamp - self._origin[mac], percent, 1)
+        while samples and (samples[0][0] < timestamp - self.window_s or len(samples) > BATTERY_TREND_MAX_SAMPLES):
+            old_timestamp, old_percent = samples.popleft()
+            self._update(sums, old_timestamp - self._origin[mac], old_percent, -1)
+
+    def _update(self, sums: list[float], t: float, p: float, sign: int):
+        sums[0] += sign
+        sums[1] += sign * t
+        sums[2] += sign * p
+        sums[3] += sign * t * t
+        sums[4] += sign * t * p
+
+    def slope(self, mac: str) -> Optional[float]:
+        """
+        Get the charge rate of a sensor in %/s, None if there are not enough readings.
+        """
+        samples = self._samples.get(mac)
+        if not samples or len(samples) < BATTERY_TREND_MIN_SAMPLES or samples[-1][0] - samples[0][0] < BATTERY_TREND_MIN_SPAN_S:
+            return None
+        n, st, sp, stt, stp = self._sums[mac]
+        denominator = n * stt - st * st
+        if denominator <= 0:
+            return None
+        return (n * stp - st * sp) / denominator
+
+    def time_to_empty(self, mac: str, percent: Optional[float]) -> Optional[int]:
+        """
+        Get the seconds left until the battery of a sensor is empty at its current discharge rate,
+        None if it is not discharging or the rate is not known yet.
+        """
+        slope = self.slope(mac)
+        if percent is None or slope is None or slope >= 0:
+            return None
+        return int(percent / -slope)
+
+    def forget(self, mac: str):
+        self._samples.pop(mac, None)
+        self._sums.pop(mac, None)
+        self._origin.pop(mac, None)
+
+    async def load(self, pool: AsyncConnectionPool):
+        """
+        Fill the windows from the database, so the trends are known right after a restart.
+        """
+        try:
+            async with pool.connection() as db:
+                async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+                    await cur.execute("""
+                        SELECT mac, EXTRACT(EPOCH FROM time_bucket(%s::interval, timestamp))::bigint AS timestamp,
+                            avg(battery) AS battery
+                        FROM readings
+                        WHERE timestamp > now() - %s * interval '1 second'
+                        GROUP BY 1, 2
+                        ORDER BY 1, 2""", (BATTERY_TREND_SEED_BUCKET, self.window_s))
+                    rows = await cur.fetchall()
+        except Exception as e:
+            logger.error(f"Error loading battery trends: {e}")
+            return
+        for row in rows:
+            self.add(row['mac'], row['timestamp'], row['battery'])
+
+battery_trends = BatteryTrends()
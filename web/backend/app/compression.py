@@ -0,0 +1,258 @@
+import os
+import zlib
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024")) # responses smaller than this are sent as they are
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+ZSTD_LEVEL = 3
+
+# Content types worth compressing, everything else is left alone unless the client refuses identity
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/vnd.apache.arrow.stream",
+    "text/csv",
+    "text/plain",
+    "text/html",
+)
+# Content types never compressed: event streams must not be buffered, the others are compressed already
+INCOMPRESSIBLE_TYPES = (
+    "text/event-stream",
+    "application/vnd.apache.parquet",
+    "application/gzip",
+    "application/zip",
+    "image/",
+    "video/",
+    "audio/",
+)
+
+class _Encoder(ABC):
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def finish(self) -> bytes:
+        ...
+
+class _GzipEncoder(_Encoder):
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+class _BrotliEncoder(_Encoder):
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+class _ZstdEncoder(_Encoder):
+    def __init__(self):
+        self._compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+# Supported encodings, preferred first when the client accepts several with the same weight
+ENCODERS: dict[str, type[_Encoder]] = {}
+if zstandard is not None:
+    ENCODERS["zstd"] = _ZstdEncoder
+if brotli is not None:
+    ENCODERS["br"] = _BrotliEncoder
+ENCODERS["gzip"] = _GzipEncoder
+
+def negotiate_encoding(accept_encoding: str) -> tuple[Optional[str], bool]:
+    """
+    Pick the best supported encoding from an Accept-Encoding header, None for identity,
+    and tell whether identity is acceptable at all.
+    `*` stands for every coding not listed, identity included; identity is acceptable unless excluded
+    by `identity;q=0`, or by `*;q=0` without identity being listed. On ties a compressed encoding wins.
+    """
+    weights: dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, *params = item.split(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        weight = 1.0
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    weight = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    weight = 0.0
+        weights[name] = weight
+    wildcard = weights.get("*")
+    identity = weights.get("identity", wildcard)
+    best, best_weight = None, identity if identity is not None else 0.0
+    for name in ENCODERS:
+        weight = weights.get(name, wildcard if wildcard is not None else 0.0)
+        if weight > best_weight or (best is None and weight > 0 and weight == best_weight):
+            best, best_weight = name, weight
+    return best, identity is None or identity > 0
+
+class CompressionMiddleware:
+    """
+    Compress responses with zstd, brotli or gzip according to the client's Accept-Encoding.
+    Small responses and uncommon content types are sent as they are, unless the client refuses identity,
+    event streams and already compressed content always are;
+    streamed responses are compressed chunk by chunk without being buffered.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding, identity = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            if not identity:
+                response = PlainTextResponse("No acceptable content encoding", status_code=406)
+                await response(scope, receive, send)
+                return
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(self.app, encoding, self.minimum_size, required=not identity)
+        await responder(scope, receive, send)
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str, minimum_size: int, required: bool = False):
+        self.app = app
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        # The client does not accept identity, so everything but INCOMPRESSIBLE_TYPES is compressed
+        self.required = required
+        self.send: Send = None
+        self.start_message: Optional[Message] = None
+        self.encoder: Optional[_Encoder] = None
+        self.passthrough = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        self.send = send
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            self.passthrough = (
+                "content-encoding" in headers
+                or content_type.startswith(INCOMPRESSIBLE_TYPES)
+                or (content_type not in COMPRESSIBLE_TYPES and not self.required)
+                or message["status"] in (204, 304)
+            )
+            if self.passthrough:
+                await self.send(message)
+            else:
+                # Wait for the first body chunk to know whether it's worth compressing
+                self.start_message = message
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            if not more_body and len(body) < self.minimum_size and not self.required:
+                self.passthrough = True
+                await self.send(start_message)
+                await self.send(message)
+                return
+            self.encoder = ENCODERS[self.encoding]()
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "content-length" in headers:
+                del headers["content-length"]
+            # Weak validators survive compression, strong ones are not valid anymore
+            etag = headers.get("etag")
+            if etag is not None and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await self.send(start_message)
+
+        data = self.encoder.compress(body)
+        if not more_body:
+            data += self.encoder.finish()
+        if data or not more_body:
+            await self.send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+REQUEST_MAX_BODY_SIZE = int(os.getenv("REQUEST_MAX_BODY_SIZE", str(10 * 1024 * 1024))) # bytes read from the client, same limit as the proxy
+REQUEST_MAX_DECOMPRESSED_SIZE = int(os.getenv("REQUEST_MAX_DECOMPRESSED_SIZE", str(4 * 1024 * 1024))) # guards against decompression bombs
+
+class BodyTooLarge(ValueError):
+    pass
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+async def read_request_body(request: Request, max_size: int = REQUEST_MAX_BODY_SIZE) -> bytes:
+    """
+    Read a request body as it was sent, raises BodyTooLarge as soon as it exceeds `max_size`.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+        raise BodyTooLarge(f"Body larger than {max_size} bytes")
+    chunks = []
+    size = 0
+    # The Content-Length may be missing (chunked uploads) or wrong, the stream is the truth
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            raise BodyTooLarge(f"Body larger than {max_size} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+def decode_request_body(body: bytes, content_encoding: Optional[str], max_size: int = REQUEST_MAX_DECOMPRESSED_SIZE) -> bytes:
+    """
+    Undo the Content-Encoding of a request body, only gzip is supported.
+    Raises BodyTooLarge if the decompressed body would exceed `max_size`,
+    UnsupportedEncoding if the encoding is not supported and ValueError if the body is corrupt.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding not in ("gzip", "x-gzip"):
+        raise UnsupportedEncoding(f"Unsupported content encoding: {encoding}")
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_size + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip body: {e}")
+    if len(data) > max_size or decompressor.unconsumed_tail:
+        raise BodyTooLarge(f"Decompressed body larger than {max_size} bytes")
+    if not decompressor.eof:
+        raise ValueError("Truncated gzip body")
+    return data
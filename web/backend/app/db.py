@@ -0,0 +1,96 @@
+from typing import AsyncIterator
+import fastapi
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+import os
+import logging
+
+from profiler import QUERY_PROFILER_ENABLED, configure_profiling
+
+logger = logging.getLogger(__name__)
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10")) # max seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300")) # close idle connections above min size after N seconds
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600")) # recycle connections after N seconds
+DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "0")) # connections shared by all the workers, 0 gives each worker a pool of DB_POOL_MAX_SIZE
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1")) # API processes, set by run.py
+# Connections every worker opens outside of its pool: the settings listener, and the worker events listener
+LISTENER_CONNECTIONS = 2 if WEB_WORKERS > 1 else 1
+
+CONNINFO = f"host={DB_HOST} port={DB_PORT} user={DB_USER} password={DB_PASSWORD}"
+
+def pool_size() -> tuple[int, int]:
+    """
+    Get the min and max size of the pool of this worker.
+    With a connection budget, every worker gets an equal share of it, minus its listeners.
+    """
+    max_size = DB_POOL_MAX_SIZE
+    if DB_CONNECTION_BUDGET > 0:
+        max_size = max(1, DB_CONNECTION_BUDGET // WEB_WORKERS - LISTENER_CONNECTIONS)
+    return min(DB_POOL_MIN_SIZE, max_size), max_size
+
+def create_pool() -> AsyncConnectionPool:
+    """
+    Create the (still closed) connection pool used by the API.
+    Connections are health checked before being handed out to a request,
+    and report their slow statements to the profiler when it is enabled.
+    """
+    min_size, max_size = pool_size()
+    return AsyncConnectionPool(
+        CONNINFO,
+        min_size=min_size,
+        max_size=max_size,
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        max_lifetime=DB_POOL_MAX_LIFETIME,
+        check=AsyncConnectionPool.check_connection,
+        configure=configure_profiling if QUERY_PROFILER_ENABLED else None,
+        name="gardeneye",
+        open=False,
+    )
+
+async def get_db(request: fastapi.Request) -> AsyncIterator[psycopg.AsyncConnection]:
+    """
+    Dependency that checks out a connection from the pool for the duration of a request.
+    The transaction is committed when the request succeeds and rolled back otherwise.
+    """
+    pool: AsyncConnectionPool = request.app.state.pool
+    async with pool.connection() as conn:
+        yield conn
+
+def pool_stats(pool: AsyncConnectionPool) -> dict:
+    """
+    Get the pool counters along with the derived wait time and saturation figures.
+    """
+    stats = pool.get_stats()
+    requests_waiting = stats.get("requests_waiting", 0)
+    requests_num = stats.get("requests_num", 0)
+    requests_queued = stats.get("requests_queued", 0)
+    requests_wait_ms = stats.get("requests_wait_ms", 0)
+    pool_size = stats.get("pool_size", 0)
+    pool_available = stats.get("pool_available", 0)
+    return {
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "pool_size": pool_size,
+        "pool_available": pool_available,
+        "in_use": pool_size - pool_available,
+        "saturation": (pool_size - pool_available) / pool.max_size if pool.max_size else 0.0,
+        "requests_waiting": requests_waiting,
+        "requests_num": requests_num,
+        "requests_queued": requests_queued,
+        "requests_wait_ms": requests_wait_ms,
+        "avg_wait_ms": requests_wait_ms / requests_queued if requests_queued else 0.0,
+        "requests_errors": stats.get("requests_errors", 0),
+        "connections_num": stats.get("connections_num", 0),
+        "connections_errors": stats.get("connections_errors", 0),
+        "connections_lost": stats.get("connections_lost", 0),
+    }
@@ -0,0 +1,62 @@
+import numpy as np
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling.
+    Returns the (sorted) indices of the `points` samples of (x, y) that best preserve the shape of the series.
+    `y` may also be a (n, k) array of k series, the triangle areas of every series are then added up.
+    `x` must be sorted and contain no NaNs, neither must `y`.
+    """
+    y = np.asarray(y, dtype=np.float64).reshape(len(x), -1)
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    buckets = points - 2
+    # The first and last points are always kept, the rest is split in points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # Average of the next bucket, which is just the last point for the last bucket
+    next_sizes = np.diff(np.append(edges[1:], n))
+    avg_x = np.add.reduceat(x, edges[1:]) / next_sizes
+    avg_y = np.add.reduceat(y, edges[1:], axis=0) / next_sizes[:, None]
+    # Buckets padded to the same size by repeating their last point, which the argmax never prefers to the original,
+    # so that only the choice of the previous point is left to the loop
+    offsets = np.arange(np.diff(edges).max())
+    index = np.minimum(edges[:-1, None] + offsets, edges[1:, None] - 1)
+    bucket_x = x[index]
+    bucket_y = y[index]
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    previous = 0
+    for i in range(buckets):
+        px, py = x[previous], y[previous]
+        # Twice the triangle area, the constant factor does not change the argmax
+        areas = np.abs((px - avg_x[i]) * (bucket_y[i] - py) - (px - bucket_x[i])[:, None] * (avg_y[i] - py)).sum(axis=1)
+        previous = index[i, int(np.argmax(areas))]
+        selected[i + 1] = previous
+    return selected
+
+def lttb_multi(x: np.ndarray, ys: list[np.ndarray], points: int) -> np.ndarray:
+    """
+    Downsample several series sharing the same x values to `points` samples (all of them if there are fewer).
+    LTTB runs once on the merged timeline, adding up the triangle areas of the series, each scaled to its own range
+    so that no unit outweighs the others. Gaps (NaNs) are filled by linear interpolation for the selection only,
+    samples where every series is missing are never selected.
+    """
+    if points < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    columns = []
+    for y in ys:
+        valid = ~np.isnan(y)
+        if not valid.any():
+            continue
+        filled = np.interp(x, x[valid], y[valid])
+        span = filled.max() - filled.min()
+        columns.append((filled - filled.min()) / span if span > 0 else np.zeros_like(filled))
+    if not columns:
+        return np.arange(0, dtype=np.int64)
+    rows = np.flatnonzero(~np.all(np.isnan(np.column_stack(ys)), axis=1))
+    merged = np.column_stack(columns)[rows]
+    return rows[lttb(x[rows], merged, points)]
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Callable, Optional
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from db import CONNINFO, WEB_WORKERS
+
+logger = logging.getLogger(__name__)
+
+WORKER_EVENTS_CHANNEL = "worker_events" # NOTIFY channel relaying in-process events to the other workers
+WORKER_EVENTS_ENABLED = WEB_WORKERS > 1
+NOTIFY_MAX_PAYLOAD = 7900 # bytes, PostgreSQL rejects payloads of 8000 bytes or more
+LISTEN_RETRY_S = 5 # wait time before reconnecting the listener
+
+Handler = Callable[[dict], None]
+
+class WorkerEvents:
+    """
+    Relays the events of this process (data changes, live readings) to the other API workers
+    through LISTEN/NOTIFY, so that their caches and live clients stay up to date.
+    Events are only relayed when the API runs more than one worker.
+    """
+    def __init__(self, enabled: bool = WORKER_EVENTS_ENABLED):
+        self.enabled = enabled
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._handlers: dict[str, Handler] = {}
+        self._resync_handlers: list[Callable[[], None]] = []
+        self._outbox: asyncio.Queue[str] = asyncio.Queue()
+        self._pool: Optional[AsyncConnectionPool] = None
+        self._tasks: list[asyncio.Task] = []
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        # Forked workers must not share the id of the process that imported the app
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+
+    def on(self, kind: str, handler: Handler):
+        """
+        Register the handler run when another worker sends an event of the given kind.
+        """
+        self._handlers[kind] = handler
+
+    def on_resync(self, handler: Callable[[], None]):
+        """
+        Register a handler run whenever the listener (re)connects, as events may have been missed.
+        """
+        self._resync_handlers.append(handler)
+
+    def send(self, kind: str, data: dict):
+        """
+        Relay an event to the other workers, it is not delivered to this one.
+        """
+        if not self.enabled or not self._tasks:
+            return
+        payload = json.dumps({"origin": self.worker_id, "kind": kind, "data": data}, separators=(",", ":"))
+        if len(payload.encode()) > NOTIFY_MAX_PAYLOAD:
+            self.dropped += 1
+            logger.warning(f"Dropping {kind} worker event, its payload is too large")
+            return
+        self._outbox.put_nowait(payload)
+
+    async def start(self, pool: AsyncConnectionPool):
+        if not self.enabled:
+            return
+        self._pool = pool
+        self._tasks = [asyncio.create_task(self._listen()), asyncio.create_task(self._send())]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _send(self):
+        while True:
+            payloads = [await self._outbox.get()]
+            while not self._outbox.empty():
+                payloads.append(self._outbox.get_nowait())
+            try:
+                async with self._pool.connection() as conn:
+                    async with conn.cursor() as cur:
+                        await cur.executemany(
+                            "SELECT pg_notify(%s, %s)", [(WORKER_EVENTS_CHANNEL, payload) for payload in payloads])
+                self.sent += len(payloads)
+            except Exception as e:
+                # The other workers catch up through their periodic sweeps and ETag time quantum
+                self.dropped += len(payloads)
+                logger.error(f"Error relaying {len(payloads)} worker events: {e}")
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {WORKER_EVENTS_CHANNEL}")
+                    for handler in self._resync_handlers:
+                        handler()
+                    async for notify in conn.notifies():
+                        self._dispatch(notify.payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker events listener disconnected: {e}")
+            await asyncio.sleep(LISTEN_RETRY_S)
+
+    def _dispatch(self, payload: str):
+        try:
+            event = json.loads(payload)
+            if event["origin"] == self.worker_id:
+                return
+            handler = self._handlers.get(event["kind"])
+            if handler is not None:
+                self.received += 1
+                handler(event["data"])
+        except Exception as e:
+            logger.error(f"Error handling worker event: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+worker_events = WorkerEvents()
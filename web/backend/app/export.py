@@ -0,0 +1,119 @@
+from typing import AsyncIterator, Literal, Optional
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet
+import psycopg.rows
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+from readings import NoReadings, fetch_bounds, retention_active, tiered_readings, time_conditions
+
+EXPORT_CHUNK_ROWS = 100_000 # rows fetched from the database (and written as one row group) at a time
+
+ExportFormat = Literal["parquet", "arrow"]
+
+MEDIA_TYPES = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+EXTENSIONS = {
+    "parquet": "parquet",
+    "arrow": "arrows",
+}
+
+SCHEMA = pa.schema([
+    ("mac", pa.dictionary(pa.int32(), pa.string())),
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("humidity", pa.float64()),
+    ("temperature", pa.float64()),
+    ("battery", pa.float64()),
+])
+
+class _ChunkSink:
+    """
+    Write-only file object that keeps what the Arrow writers produce until it is drained.
+    """
+    def __init__(self):
+        self.closed = False
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _to_table(mac: str, rows: list[tuple]) -> pa.Table:
+    timestamps, humidity, temperature, battery = zip(*rows)
+    return pa.Table.from_arrays([
+        pa.DictionaryArray.from_arrays(pa.array([0] * len(rows), pa.int32()), pa.array([mac])),
+        pa.array(timestamps, pa.int64()).cast(SCHEMA.field("timestamp").type),
+        pa.array(humidity, pa.float64()),
+        pa.array(temperature, pa.float64()),
+        pa.array(battery, pa.float64()),
+    ], schema=SCHEMA)
+
+async def stream_export(
+    pool: AsyncConnectionPool,
+    macs: list[str],
+    format: ExportFormat,
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Stream the raw readings of several sensors as a Parquet file or an Arrow IPC stream.
+    Sensors are exported one after the other, oldest reading first, so that a row group
+    (or record batch) never mixes sensors.
+    Parquet output is zstd compressed, the Arrow stream is left uncompressed so it can be memory mapped.
+    Readings dropped by the retention policies are replaced by the averages of the rollups still kept.
+    Raises NoReadings before the first chunk if there are no readings, see `start_stream`.
+    """
+    conditions = sql.SQL(" AND ").join(time_conditions("timestamp", start, end) or [sql.SQL("TRUE")])
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=psycopg.rows.dict_row) as cur:
+            # Also finds readings only kept in the rollups
+            if await fetch_bounds(cur, macs, start, end) is None:
+                raise NoReadings(macs)
+        sink = _ChunkSink()
+        if format == "parquet":
+            writer = pyarrow.parquet.ParquetWriter(sink, SCHEMA, compression="zstd")
+        else:
+            writer = pyarrow.ipc.new_stream(sink, SCHEMA)
+        # Closed even when the client disconnects, which closes this generator early
+        try:
+            tiered = await retention_active(conn)
+            for mac in macs:
+                query = sql.SQL("""
+                    SELECT EXTRACT(EPOCH FROM timestamp)::bigint, humidity, temperature, battery
+                    FROM {readings}
+                    WHERE {conditions}
+                    ORDER BY timestamp""").format(readings=tiered_readings(mac, tiered), conditions=conditions)
+                # Server side cursor, so only one chunk is held in memory at a time
+                async with conn.cursor(name="readings_export") as cur:
+                    await cur.execute(query)
+                    while True:
+                        rows = await cur.fetchmany(EXPORT_CHUNK_ROWS)
+                        if not rows:
+                            break
+                        writer.write_table(_to_table(mac, rows))
+                        yield sink.drain()
+        finally:
+            writer.close()
+    yield sink.drain()
@@ -0,0 +1,63 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+HUB_QUEUE_SIZE = 256 # events buffered per client before the oldest ones are dropped
+HEARTBEAT_S = 15 # keep-alive comment interval, below the proxy read timeout
+
+class BroadcastHub:
+    """
+    In-process fan-out of live events to the connected dashboard clients.
+    Every client gets its own bounded queue, slow clients lose their oldest events
+    instead of slowing down the publishers.
+    """
+    def __init__(self, queue_size: int = HUB_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict):
+        self.published += 1
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait((event, data))
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
+
+    async def stream(self) -> AsyncIterator[str]:
+        """
+        Server-Sent Events stream of the published events, with periodic heartbeats.
+        """
+        queue = self.subscribe()
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            self.unsubscribe(queue)
+
+hub = BroadcastHub()
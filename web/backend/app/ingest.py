@@ -0,0 +1,312 @@
+import asyncio
+import os
+import time
+import logging
+from typing import Optional
+
+import numpy as np
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+
+from events import worker_events
+from alerts import alert_engine
+from battery import battery_trends
+from hub import hub
+from metrics import db_timer, readings_ingested
+from models import ReadingsProps
+from watermark import watermarks
+
+logger = logging.getLogger(__name__)
+
+INGEST_BUFFER_ENABLED = os.getenv("INGEST_BUFFER_ENABLED", "false").lower() in ("1", "true", "yes")
+INGEST_BUFFER_FLUSH_ROWS = int(os.getenv("INGEST_BUFFER_FLUSH_ROWS", "5000")) # flush as soon as this many rows are pending
+INGEST_BUFFER_FLUSH_INTERVAL = float(os.getenv("INGEST_BUFFER_FLUSH_INTERVAL", "1.0")) # flush at least every N seconds
+INGEST_BUFFER_CAPACITY = int(os.getenv("INGEST_BUFFER_CAPACITY", "100000")) # max rows held in memory
+INGEST_BUFFER_MAX_RETRIES = 3 # failed flushes before a batch is dropped
+
+# Packed little endian upload format sent by the nodes: u64 now, then (u64 timestamp, f32 humidity, f32 temperature, f32 battery) per reading
+BINARY_CONTENT_TYPES = ("application/vnd.gardeneye.readings", "application/octet-stream")
+BINARY_HEADER = np.dtype("<u8")
+BINARY_READING = np.dtype([
+    ("timestamp", "<u8"),
+    ("humidity", "<f4"),
+    ("temperature", "<f4"),
+    ("battery", "<f4"),
+])
+BINARY_DECIMALS = 6 # same precision as the JSON payload
+BINARY_MAX_TIMESTAMP = 253402300799 # 9999-12-31 23:59:59 UTC, larger u64 values would overflow the database
+
+class ReadingRows:
+    """
+    Column oriented batch of readings (possibly from many sensors) ready to be written to the database.
+    Timestamps are absolute unix timestamps in seconds.
+    """
+    def __init__(self):
+        self.macs: list[str] = []
+        self.timestamps: list[int] = []
+        self.humidity: list[float] = []
+        self.temperature: list[float] = []
+        self.battery: list[float] = []
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def add(self, mac: str, readings: ReadingsProps, now: Optional[int] = None):
+        """
+        Append the readings uploaded by a sensor node.
+        The node timestamps are relative to its own clock (`readings.now`), so they are
+        shifted by a single offset computed once for the whole upload.
+        """
+        if now is None:
+            now = int(time.time())
+        offset = now - readings.now
+        self.macs.extend([mac] * len(readings.timestamps))
+        self.timestamps.extend(ts + offset for ts in readings.timestamps)
+        self.humidity.extend(readings.humidity)
+        self.temperature.extend(readings.temperature)
+        self.battery.extend(readings.battery)
+
+    def extend(self, other: 'ReadingRows'):
+        self.macs.extend(other.macs)
+        self.timestamps.extend(other.timestamps)
+        self.humidity.extend(other.humidity)
+        self.temperature.extend(other.temperature)
+        self.battery.extend(other.battery)
+
+async def insert_readings(db: psycopg.AsyncConnection, rows: ReadingRows):
+    """
+    Write a batch of readings, registering any unknown sensor on the way
+    and moving the latest reading of each sensor forward.
+    Both statements are array based and sent in a single pipeline, so the cost
+    of an upload does not grow with the number of rows.
+    Duplicate (mac, timestamp) pairs are silently ignored.
+    """
+    if len(rows) == 0:
+        return
+    with db_timer("ingest_insert"):
+        async with db.pipeline():
+            async with db.cursor() as cur:
+                await cur.execute(
+                    """INSERT INTO sensors (mac)
+                    SELECT DISTINCT unnest(%s::varchar[])
+                    ON CONFLICT (mac) DO NOTHING""",
+                    (rows.macs,)
+                )
+                await cur.execute(
+                    """WITH inserted AS (
+                        INSERT INTO readings (mac, timestamp, humidity, temperature, battery)
+                        SELECT r.mac, to_timestamp(r.timestamp), r.humidity, r.temperature, r.battery
+                        FROM unnest(%s::varchar[], %s::bigint[], %s::float8[], %s::float8[], %s::float8[])
+                            AS r(mac, timestamp, humidity, temperature, battery)
+                        ON CONFLICT (mac, timestamp) DO NOTHING
+                        RETURNING mac, timestamp, humidity, temperature, battery
+                    )
+                    INSERT INTO sensor_latest (mac, timestamp, humidity, temperature, battery)
+                    SELECT DISTINCT ON (mac) mac, timestamp, humidity, temperature, battery
+                    FROM inserted
+                    ORDER BY mac, timestamp DESC
+                    ON CONFLICT (mac) DO UPDATE SET
+                        timestamp = excluded.timestamp,
+                        humidity = excluded.humidity,
+                        temperature = excluded.temperature,
+                        battery = excluded.battery
+                    WHERE excluded.timestamp > sensor_latest.timestamp""",
+                    (rows.macs, rows.timestamps, rows.humidity, rows.temperature, rows.battery)
+                )
+
+def decode_binary_readings(body: bytes) -> ReadingsProps:
+    """
+    Decode a binary upload without copying it, raises ValueError if its size is not valid,
+    if it has no readings, if a timestamp is out of range or if any value is NaN or infinite.
+    """
+    if len(body) < BINARY_HEADER.itemsize or (len(body) - BINARY_HEADER.itemsize) % BINARY_READING.itemsize != 0:
+        raise ValueError("Invalid binary readings size")
+    now = int(np.frombuffer(body, BINARY_HEADER, count=1)[0])
+    records = np.frombuffer(body, BINARY_READING, offset=BINARY_HEADER.itemsize)
+    if len(records) == 0:
+        raise ValueError("No readings")
+    # Checked while still unsigned, a cast to int64 would wrap the largest values to negative ones
+    if now > BINARY_MAX_TIMESTAMP or records["timestamp"].max() > BINARY_MAX_TIMESTAMP:
+        raise ValueError(f"Invalid timestamp, values must be at most {BINARY_MAX_TIMESTAMP}")
+    for field in ("humidity", "temperature", "battery"):
+        if not np.isfinite(records[field]).all():
+            raise ValueError(f"Invalid {field}, values must be finite")
+    # The layout guarantees types and equal lengths, and the values were checked above, so pydantic validation is skipped
+    return ReadingsProps.model_construct(
+        timestamps=records["timestamp"].astype(np.int64).tolist(),
+        humidity=np.round(records["humidity"].astype(np.float64), BINARY_DECIMALS).tolist(),
+        temperature=np.round(records["temperature"].astype(np.float64), BINARY_DECIMALS).tolist(),
+        battery=np.round(records["battery"].astype(np.float64), BINARY_DECIMALS).tolist(),
+        now=now,
+    )
+
+RELAY_BATCH_SENSORS = 32 # sensors per relayed readings event, keeps the NOTIFY payload small
+
+def readings_written(rows: ReadingRows):
+    """
+    Run once a batch of readings has been committed:
+    bump the watermarks and push the latest reading of each sensor to the live clients,
+    of this worker and of the other ones.
+    """
+    latest: dict[str, int] = {}
+    counts: dict[str, int] = {}
+    for i, mac in enumerate(rows.macs):
+        counts[mac] = counts.get(mac, 0) + 1
+        if mac not in latest or rows.timestamps[i] > rows.timestamps[latest[mac]]:
+            latest[mac] = i
+    readings_ingested.inc(amount=len(rows))
+    events = [{
+        "mac": mac,
+        "count": counts[mac],
+        "latest_reading": {
+            "timestamp": rows.timestamps[i],
+            "humidity": rows.humidity[i],
+            "temperature": rows.temperature[i],
+            "battery": rows.battery[i],
+        }
+    } for mac, i in latest.items()]
+    readings_received(events)
+    for start in range(0, len(events), RELAY_BATCH_SENSORS):
+        worker_events.send("readings", {"events": events[start:start + RELAY_BATCH_SENSORS]})
+
+def readings_received(events: list[dict], record: bool = True):
+    """
+    Update the in-process state with the `readings` events of a committed batch.
+    Alerts are only recorded by the worker that wrote the batch.
+    """
+    watermarks.bump([event["mac"] for event in events], relay=False)
+    for event in events:
+        latest = event["latest_reading"]
+        alert_engine.seen(event["mac"], latest["timestamp"], latest["battery"], record)
+        battery_trends.add(event["mac"], latest["timestamp"], latest["battery"])
+        hub.publish("readings", event)
+
+worker_events.on("readings", lambda data: readings_received(data["events"], record=False))
+
+class IngestBuffer:
+    """
+    Write-behind queue for sensor uploads.
+    Uploads are acknowledged as soon as they are queued and are written to the database
+    in large multi-sensor batches, either when enough rows are pending or periodically.
+    Memory is bounded: uploads that do not fit are rejected so that the node retries later.
+    """
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        flush_rows: int = INGEST_BUFFER_FLUSH_ROWS,
+        flush_interval: float = INGEST_BUFFER_FLUSH_INTERVAL,
+        capacity: int = INGEST_BUFFER_CAPACITY,
+    ):
+        self.pool = pool
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.capacity = capacity
+        self.pending = ReadingRows()
+        self._retries = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        # Counters
+        self.accepted_uploads = 0
+        self.rejected_uploads = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.failed_flushes = 0
+        self.dropped_batches = 0
+        self.dropped_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def submit(self, rows: ReadingRows) -> bool:
+        """
+        Queue a batch of rows, returns False if the buffer is full.
+        """
+        if len(self.pending) + len(rows) > self.capacity:
+            self.rejected_uploads += 1
+            return False
+        self.pending.extend(rows)
+        self.accepted_uploads += 1
+        if len(self.pending) >= self.flush_rows:
+            self._wakeup.set()
+        return True
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the periodic flush and write whatever is still pending.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Failed batches are retried until they are written or dropped
+        while len(self.pending) > 0:
+            await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Write all pending rows in a single transaction.
+        Returns False if the write failed.
+        """
+        async with self._flush_lock:
+            batch = self.pending
+            if len(batch) == 0:
+                return True
+            self.pending = ReadingRows()
+            start = time.perf_counter()
+            try:
+                async with self.pool.connection() as conn:
+                    await insert_readings(conn, batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                self._retries += 1
+                logger.error(f"Error flushing {len(batch)} buffered readings: {e}")
+                if self._retries < INGEST_BUFFER_MAX_RETRIES and len(batch) + len(self.pending) <= self.capacity:
+                    # Put the batch back in front of whatever arrived in the meantime
+                    batch.extend(self.pending)
+                    self.pending = batch
+                else:
+                    self._retries = 0
+                    self.dropped_batches += 1
+                    self.dropped_rows += len(batch)
+                return False
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            readings_written(batch)
+            self._retries = 0
+            self.flushes += 1
+            self.flushed_rows += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return True
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": len(self.pending),
+            "capacity": self.capacity,
+            "accepted_uploads": self.accepted_uploads,
+            "rejected_uploads": self.rejected_uploads,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "failed_flushes": self.failed_flushes,
+            "dropped_batches": self.dropped_batches,
+            "dropped_rows": self.dropped_rows,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import uuid
+from typing import Literal, Optional
+
+import psycopg
+import psycopg.rows
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+from alerts import alert_engine
+from battery import battery_trends
+from photos import remove_photos
+from watermark import watermarks
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1")) # jobs run at the same time, deletes are IO bound on the database
+JOB_HISTORY_DAYS = int(os.getenv("JOB_HISTORY_DAYS", "7")) # finished jobs are forgotten after N days
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "5")) # how often the jobs table is checked for jobs queued by other workers
+JOB_STALE_S = int(os.getenv("JOB_STALE_S", "300")) # running jobs without a heartbeat for this long are claimed again
+
+JobKind = Literal["delete_readings", "delete_sensor"]
+
+ROLLUP_VIEWS = ("readings_hourly", "readings_daily")
+
+class JobRunner:
+    """
+    Runs heavy deletes in the background, one chunk of the readings hypertable per transaction,
+    so that locks are short lived and chunks are decompressed one at a time.
+    The `jobs` table is the queue: jobs are claimed with `FOR UPDATE SKIP LOCKED` by any worker,
+    and their progress can be polled from it. Running jobs send a heartbeat with every chunk,
+    a job whose worker died stops sending it and is claimed again, deletes being idempotent.
+    """
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._pool: Optional[AsyncConnectionPool] = None
+        # Jobs being run by this process
+        self._running: set[str] = set()
+
+    async def start(self, pool: AsyncConnectionPool):
+        self._pool = pool
+        # Also picks up the jobs left queued, or stale, by a previous run
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        if self._running and self._pool is not None:
+            # Whatever was deleted so far stays deleted, another worker (or the next run) finishes the job
+            try:
+                async with self._pool.connection() as conn:
+                    await conn.execute("""
+                        UPDATE jobs SET status = 'queued', heartbeat_at = NULL
+                        WHERE id = ANY(%s) AND status = 'running'""", (list(self._running),))
+            except Exception as e:
+                logger.error(f"Error requeuing interrupted jobs: {e}")
+            self._running.clear()
+
+    async def submit(self, db: psycopg.AsyncConnection, kind: JobKind, mac: str) -> str:
+        """
+        Queue a job and return its id, or the id of the same job if it is already queued or running.
+        """
+        async with db.cursor() as cur:
+            job_id = str(uuid.uuid4())
+            # Other workers may be submitting the same job, the unique index settles it
+            await cur.execute("""
+                INSERT INTO jobs (id, kind, mac) VALUES (%s, %s, %s)
+                ON CONFLICT (kind, mac) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING id""", (job_id, kind, mac))
+            inserted = await cur.fetchone() is not None
+            if not inserted:
+                await cur.execute("""
+                    SELECT id FROM jobs
+                    WHERE kind = %s AND mac = %s AND status IN ('queued', 'running')""", (kind, mac))
+                row = await cur.fetchone()
+            await db.commit()
+        if not inserted:
+            # The job finished in the meantime if it's not found
+            return str(row[0]) if row is not None else await self.submit(db, kind, mac)
+        self._wakeup.set()
+        return job_id
+
+    async def _work(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error(f"Error claiming a job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_S)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            job_id, kind, mac = job
+            self._running.add(job_id)
+            try:
+                await self._run(job_id, kind, mac)
+            finally:
+                self._running.discard(job_id)
+
+    async def _claim(self) -> Optional[tuple[str, JobKind, str]]:
+        """
+        Mark the oldest queued (or stale) job as running and return it, None if there is none.
+        """
+        async with self._pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    UPDATE jobs SET status = 'running', started_at = coalesce(started_at, now()), heartbeat_at = now()
+                    WHERE id = (
+                        SELECT id FROM jobs
+                        WHERE status = 'queued'
+                            OR (status = 'running' AND coalesce(heartbeat_at, created_at) < now() - %s * interval '1 second')
+                        ORDER BY created_at
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id::text, kind, mac""", (JOB_STALE_S,))
+                return await cur.fetchone()
+
+    async def _run(self, job_id: str, kind: JobKind, mac: str):
+        try:
+            async with self._pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "DELETE FROM jobs WHERE finished_at < now() - %s * interval '1 day'", (JOB_HISTORY_DAYS,))
+                    await cur.execute(
+                        """SELECT range_start, range_end FROM timescaledb_information.chunks
+                        WHERE hypertable_name = 'readings'
+                        ORDER BY range_start""")
+                    chunks = await cur.fetchall()
+                    await cur.execute(
+                        "UPDATE jobs SET chunks_total = %s, chunks_done = 0, heartbeat_at = now() WHERE id = %s",
+                        (len(chunks), job_id))
+                    await conn.commit()
+                await self._delete_readings(conn, job_id, mac, chunks)
+                if kind == "delete_sensor":
+                    await self._delete_sensor(conn, mac)
+                await conn.execute(
+                    "UPDATE jobs SET status = 'done', finished_at = now() WHERE id = %s", (job_id,))
+                await conn.commit()
+        except Exception as e:
+            logger.error(f"Error running job {job_id}: {e}")
+            try:
+                # On a fresh connection, the one of the job may be the problem
+                async with self._pool.connection() as conn:
+                    await conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = %s, finished_at = now() WHERE id = %s",
+                        (str(e), job_id))
+            except Exception as e:
+                # The heartbeat goes stale and the job is claimed again
+                logger.error(f"Error marking job {job_id} as failed: {e}")
+        finally:
+            watermarks.bump([mac])
+            alert_engine.request_sweep()
+            battery_trends.forget(mac)
+
+    async def _delete_readings(self, conn: psycopg.AsyncConnection, job_id: str, mac: str, chunks: list[tuple]):
+        async with conn.cursor() as cur:
+            for range_start, range_end in chunks:
+                # The time range restricts the delete to a single chunk
+                await cur.execute(
+                    "DELETE FROM readings WHERE mac = %s AND timestamp >= %s AND timestamp < %s",
+                    (mac, range_start, range_end))
+                await cur.execute(
+                    """UPDATE jobs SET chunks_done = chunks_done + 1, rows_deleted = rows_deleted + %s, heartbeat_at = now()
+                    WHERE id = %s""",
+                    (max(cur.rowcount, 0), job_id))
+                await conn.commit()
+            # Rows inserted while the chunks were being processed
+            await cur.execute("DELETE FROM readings WHERE mac = %s", (mac,))
+            await cur.execute(
+                "UPDATE jobs SET rows_deleted = rows_deleted + %s WHERE id = %s", (max(cur.rowcount, 0), job_id))
+            # The rollups would only forget the sensor once their refresh window covers the deleted ranges
+            await cur.execute(
+                """SELECT materialization_hypertable_schema, materialization_hypertable_name
+                FROM timescaledb_information.continuous_aggregates
+                WHERE view_name = ANY(%s)""", (list(ROLLUP_VIEWS),))
+            for schema, table in await cur.fetchall():
+                await cur.execute(sql.SQL("DELETE FROM {} WHERE mac = %s").format(sql.Identifier(schema, table)), (mac,))
+            await cur.execute("DELETE FROM sensor_latest WHERE mac = %s", (mac,))
+            await conn.commit()
+
+    async def _delete_sensor(self, conn: psycopg.AsyncConnection, mac: str):
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT has_photo, photo_ext FROM sensors WHERE mac = %s", (mac,))
+            sensor = await cur.fetchone()
+            if sensor is not None and sensor[0]:
+                await asyncio.to_thread(remove_photos, mac, sensor[1])
+            # Nothing is left to cascade to, so this is cheap
+            await cur.execute("DELETE FROM sensors WHERE mac = %s", (mac,))
+
+    async def get(self, db: psycopg.AsyncConnection, job_id: str) -> Optional[dict]:
+        async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+            await cur.execute("""
+                SELECT id::text AS id, kind, mac, status, chunks_total, chunks_done, rows_deleted, error,
+                    EXTRACT(EPOCH FROM created_at)::bigint AS created_at,
+                    EXTRACT(EPOCH FROM started_at)::bigint AS started_at,
+                    EXTRACT(EPOCH FROM finished_at)::bigint AS finished_at
+                FROM jobs WHERE id = %s""", (job_id,))
+            return await cur.fetchone()
+
+job_runner = JobRunner()
@@ -0,0 +1,189 @@
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Histogram buckets, in seconds for durations and in bytes for sizes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # Per label values: count of every bucket (plus +Inf), and the sum of the observations
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "gardeneye_http_requests_total", "HTTP requests handled", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "gardeneye_http_request_duration_seconds", "HTTP request latency", ("method", "route")))
+http_in_flight = registry.register(Gauge(
+    "gardeneye_http_requests_in_flight", "HTTP requests being handled"))
+http_request_size = registry.register(Histogram(
+    "gardeneye_http_request_size_bytes", "HTTP request body size", ("method", "route"), SIZE_BUCKETS))
+http_response_size = registry.register(Histogram(
+    "gardeneye_http_response_size_bytes", "HTTP response body size, after compression", ("method", "route"), SIZE_BUCKETS))
+db_query_latency = registry.register(Histogram(
+    "gardeneye_db_query_duration_seconds", "Database query latency", ("query",)))
+readings_ingested = registry.register(Counter(
+    "gardeneye_readings_ingested_total", "Readings written to the database"))
+readings_uploads = registry.register(Counter(
+    "gardeneye_readings_uploads_total", "Readings uploads received", ("format",)))
+db_pool = registry.register(Gauge(
+    "gardeneye_db_pool", "Database connection pool statistics", ("stat",)))
+ingest_buffer = registry.register(Gauge(
+    "gardeneye_ingest_buffer", "Ingest buffer statistics", ("stat",)))
+
+def db_timer(query: str):
+    """
+    Time a database query, `query` names it in the `gardeneye_db_query_duration_seconds` histogram.
+    """
+    return db_query_latency.time(query)
+
+def route_path(scope: Scope) -> str:
+    """
+    Get the template of the route that handled a request, "unmatched" if none did.
+    """
+    route = scope.get("route")
+    if route is None and "endpoint" in scope:
+        # Routes added by the framework (docs, OpenAPI schema) are plain Starlette routes that don't record themselves
+        for candidate in getattr(getattr(scope.get("app"), "router", None), "routes", ()):
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    # Unmatched paths are grouped together, they are not worth a series each
+    return getattr(route, "path", "unmatched")
+
+class MetricsMiddleware:
+    """
+    Count and time every HTTP request, labelled by route template so that the number of series stays bounded.
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+        response_size = 0
+
+        async def send_wrapper(message: Message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            path = route_path(scope)
+            method = scope["method"]
+            http_requests.inc(method, path, str(status))
+            http_latency.observe(time.perf_counter() - start, method, path)
+            http_response_size.observe(response_size, method, path)
+            for name, value in scope["headers"]:
+                if name == b"content-length":
+                    http_request_size.observe(int(value), method, path)
+                    break
@@ -16,12 +16,52 @@ class ReadingsProps(pydantic.BaseModel):
             raise ValueError('All list fields (timestamps, humidity, temperature, battery) must have the same length')
         return self
 
+class ReadingsSeriesProps(ReadingsProps):
+    battery_percent: list[Optional[float]]  # estimated remaining charge of every point
+
+class ExtendedReadingsProps(ReadingsSeriesProps):
+    humidity_min: list[Optional[float]]
+    humidity_max: list[Optional[float]]
+    temperature_min: list[Optional[float]]
+    temperature_max: list[Optional[float]]
+    battery_min: list[Optional[float]]
+    battery_max: list[Optional[float]]
+    samples: list[int]
+
+    @pydantic.model_validator(mode="after")
+    def check_extended_list_lengths(self):
+        lists = [
+            self.timestamps, self.humidity_min, self.humidity_max, self.temperature_min,
+            self.temperature_max, self.battery_min, self.battery_max, self.samples
+        ]
+        lengths = [len(lst) for lst in lists]
+        if len(set(lengths)) > 1:
+            raise ValueError('All extended list fields must have the same length as timestamps')
+        return self
+
+class BatchReadingsProps(pydantic.BaseModel):
+    """
+    Bucketed readings of several sensors sharing the same buckets, stored column-wise:
+    `humidity[i][j]` is the value of `sensors[i]` in the bucket starting at `timestamps[j]`.
+    Buckets without readings for a sensor are null.
+    """
+    sensors: list[str]
+    timestamps: list[int]
+    humidity: list[list[Optional[float]]]
+    temperature: list[list[Optional[float]]]
+    battery: list[list[Optional[float]]]
+    battery_percent: list[list[Optional[float]]]
+    now: int
+
 class SensorProps(pydantic.BaseModel):
     mac: str
     online: bool
     name: Optional[str] = None
     has_photo: bool = False
+    photo_hash: Optional[str] = None
     latest_reading: Optional['LatestReadingProps'] = None
+    battery_percent: Optional[float] = None  # estimated remaining charge of the latest reading
+    battery_time_to_empty: Optional[int] = None  # seconds, at the recent discharge rate, None unless discharging
 
 class LatestReadingProps(pydantic.BaseModel):
     timestamp: int
@@ -45,4 +85,33 @@ class GlobalSettingsProps(pydantic.BaseModel):
     sync_time: tuple[int, int]  # (hour, minute)
     battery_warning_threshold: float
     battery_critical_threshold: float
-    max_latency: int
\ No newline at end of file
+    max_latency: int
+    # Days every tier is kept for, 0 keeps it forever
+    raw_retention_days: int = pydantic.Field(0, ge=0)
+    hourly_retention_days: int = pydantic.Field(0, ge=0)
+    daily_retention_days: int = pydantic.Field(0, ge=0)
+
+class JobProps(pydantic.BaseModel):
+    id: str
+    kind: Literal['delete_readings', 'delete_sensor']
+    mac: str
+    status: Literal['queued', 'running', 'done', 'failed']
+    chunks_total: Optional[int] = None
+    chunks_done: int = 0
+    rows_deleted: int = 0
+    error: Optional[str] = None
+    created_at: int
+    started_at: Optional[int] = None
+    finished_at: Optional[int] = None
+
+class JobAcceptedProps(pydantic.BaseModel):
+    job_id: str
+    status_url: str
+
+class AlertProps(pydantic.BaseModel):
+    id: int
+    mac: str
+    kind: Literal['offline', 'battery_low', 'battery_critical']
+    started_at: int
+    ended_at: Optional[int] = None  # None while the alert is active
+    value: Optional[float] = None
\ No newline at end of file
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Literal, Optional
+
+from fastapi import UploadFile
+from PIL import Image, ImageOps
+
+UPLOADS_PATH = os.getenv("UPLOADS_PATH", "/uploads")
+PHOTOS_DIR = Path(f"{UPLOADS_PATH}/photos")
+
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", str(10 * 1024 * 1024))) # same limit as the proxy
+PHOTO_CHUNK_SIZE = 1024 * 1024 # bytes read from the upload and written to disk at a time
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", "2")) # threads resizing photos, Pillow releases the GIL while working
+PHOTO_WEBP_QUALITY = 80
+PHOTO_CACHE_BYTES = int(os.getenv("PHOTO_CACHE_BYTES", str(16 * 1024 * 1024))) # memory used to keep hot variants, 0 to disable
+PHOTO_CACHE_SIZES = ("thumb", "card") # only the small variants are cached
+PHOTO_HASH_LENGTH = 16
+
+PhotoSize = Literal["thumb", "card", "original"]
+
+# Longest side in pixels of every resized variant
+VARIANT_SIZES = {
+    "thumb": 160,
+    "card": 640,
+}
+
+CONTENT_TYPE_TO_EXT = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif'
+}
+
+EXT_TO_MEDIA_TYPE = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.gif': 'image/gif'
+}
+
+# Ensure photos directory exists
+PHOTOS_DIR.mkdir(parents=True, exist_ok=True)
+
+_executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix="photos")
+
+class PhotoTooLarge(ValueError):
+    pass
+
+class InvalidPhoto(ValueError):
+    pass
+
+def photo_stem(mac: str) -> str:
+    return mac.replace(":", "").lower()
+
+def variant_path(mac: str, size: str) -> Path:
+    return PHOTOS_DIR / f"{photo_stem(mac)}.{size}.webp"
+
+def original_path(mac: str, ext: str) -> Path:
+    return PHOTOS_DIR / f"{photo_stem(mac)}{ext}"
+
+def partial_path(path: Path) -> Path:
+    """
+    Get a temporary path to write `path` to before moving it in place, unique so that concurrent writers never share it.
+    """
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+
+def find_original(mac: str) -> Optional[Path]:
+    """
+    Look for the photo of a sensor uploaded before its extension was recorded in the database.
+    """
+    for ext in EXT_TO_MEDIA_TYPE:
+        path = original_path(mac, ext)
+        if path.exists():
+            return path
+    return None
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(PHOTO_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()[:PHOTO_HASH_LENGTH]
+
+def remove_photos(mac: str, ext: Optional[str] = None) -> int:
+    """
+    Remove the photo of a sensor along with its variants, returns the number of files removed.
+    The original is looked up by extension if `ext` is not known.
+    """
+    original = original_path(mac, ext) if ext is not None else find_original(mac)
+    removed = 0
+    for path in (original, *(variant_path(mac, size) for size in VARIANT_SIZES)):
+        if path is not None and path.exists():
+            path.unlink(missing_ok=True)
+            removed += 1
+    photo_cache.discard(mac)
+    return removed
+
+class PhotoCache:
+    """
+    Bounded LRU of the bytes of the most requested photo variants, keyed by sensor, content hash and size.
+    """
+    def __init__(self, max_bytes: int = PHOTO_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple[str, str, str], bytes] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mac: str, photo_hash: str, size: str) -> Optional[bytes]:
+        key = (photo_stem(mac), photo_hash, size)
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def put(self, mac: str, photo_hash: str, size: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        key = (photo_stem(mac), photo_hash, size)
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous)
+        self._entries[key] = data
+        self._bytes += len(data)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+
+    def discard(self, mac: str):
+        stem = photo_stem(mac)
+        for key in [key for key in self._entries if key[0] == stem]:
+            self._bytes -= len(self._entries.pop(key))
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+photo_cache = PhotoCache()
+
+def _write_variants(source: Path, mac: str):
+    """
+    Generate every resized WebP variant of a photo, runs on the worker pool.
+    """
+    try:
+        with Image.open(source) as image:
+            # Phone pictures are usually stored sideways with an EXIF orientation tag
+            image = ImageOps.exif_transpose(image)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            for size, pixels in VARIANT_SIZES.items():
+                variant = image.copy()
+                variant.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+                target = variant_path(mac, size)
+                partial = partial_path(target)
+                try:
+                    variant.save(partial, format="WEBP", quality=PHOTO_WEBP_QUALITY)
+                    partial.replace(target)
+                except BaseException:
+                    partial.unlink(missing_ok=True)
+                    raise
+    except (OSError, Image.DecompressionBombError) as e:
+        raise InvalidPhoto(f"Cannot process image: {e}")
+
+async def make_variants(source: Path, mac: str):
+    await asyncio.get_running_loop().run_in_executor(_executor, _write_variants, source, mac)
+
+async def save_photo(mac: str, photo: UploadFile, ext: str, previous_ext: Optional[str] = None) -> str:
+    """
+    Stream an uploaded photo to disk in chunks and generate its resized variants.
+    The previous photo of the sensor is replaced only once the new one has been fully processed.
+    Returns the content hash of the photo.
+    """
+    target = original_path(mac, ext)
+    partial = partial_path(PHOTOS_DIR / f"{photo_stem(mac)}.upload")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with await asyncio.to_thread(open, partial, "wb") as buffer:
+            while chunk := await photo.read(PHOTO_CHUNK_SIZE):
+                size += len(chunk)
+                if size > PHOTO_MAX_BYTES:
+                    raise PhotoTooLarge(f"Photo larger than {PHOTO_MAX_BYTES} bytes")
+                digest.update(chunk)
+                await asyncio.to_thread(buffer.write, chunk)
+        await make_variants(partial, mac)
+        previous = original_path(mac, previous_ext) if previous_ext is not None else find_original(mac)
+        if previous is not None and previous != target:
+            previous.unlink(missing_ok=True)
+        await asyncio.to_thread(partial.replace, target)
+    except BaseException:
+        partial.unlink(missing_ok=True)
+        raise
+    photo_cache.discard(mac)
+    return digest.hexdigest()[:PHOTO_HASH_LENGTH]
+
+async def get_photo(mac: str, ext: str, photo_hash: str, size: PhotoSize) -> tuple[Path, str, Optional[bytes]]:
+    """
+    Path, media type and (if cached) content of the requested size of a sensor's photo.
+    Variants missing for photos uploaded before they existed are generated on first request.
+    """
+    if size == "original":
+        return original_path(mac, ext), EXT_TO_MEDIA_TYPE.get(ext, 'image/jpeg'), None
+    cached = photo_cache.get(mac, photo_hash, size) if size in PHOTO_CACHE_SIZES else None
+    path = variant_path(mac, size)
+    if cached is not None:
+        return path, 'image/webp', cached
+    if not path.exists():
+        await make_variants(original_path(mac, ext), mac)
+    data = None
+    if size in PHOTO_CACHE_SIZES and PHOTO_CACHE_BYTES > 0:
+        data = await asyncio.to_thread(path.read_bytes)
+        photo_cache.put(mac, photo_hash, size, data)
+    return path, 'image/webp', data
@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Optional
+
+import psycopg
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+QUERY_PROFILER_ENABLED = os.getenv("QUERY_PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+QUERY_PROFILER_THRESHOLD_MS = float(os.getenv("QUERY_PROFILER_THRESHOLD_MS", "100")) # statements slower than this are recorded
+QUERY_PROFILER_EXPLAIN_RATE = float(os.getenv("QUERY_PROFILER_EXPLAIN_RATE", "0.1")) # fraction of slow SELECTs that get an EXPLAIN ANALYZE
+QUERY_PROFILER_BUFFER_SIZE = int(os.getenv("QUERY_PROFILER_BUFFER_SIZE", "200")) # slow statements kept, oldest are dropped
+QUERY_PROFILER_EXPLAIN_TIMEOUT_MS = 10000
+PARAM_MAX_LENGTH = 200 # longer parameters (such as ingest arrays) are truncated
+
+# EXPLAIN ANALYZE runs the statement again, so only plain reads are explained
+_WRITE_STATEMENT = re.compile(r"\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|COPY|CALL)\b", re.IGNORECASE)
+
+def _query_text(query: Any, conn: psycopg.AsyncConnection) -> str:
+    if isinstance(query, sql.Composable):
+        return query.as_string(conn)
+    if isinstance(query, bytes):
+        return query.decode()
+    return str(query)
+
+def _short(value: Any) -> str:
+    text = repr(value)
+    return text if len(text) <= PARAM_MAX_LENGTH else text[:PARAM_MAX_LENGTH] + "..."
+
+def _format_params(params: Any) -> Any:
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: _short(value) for key, value in params.items()}
+    return [_short(value) for value in params]
+
+def _is_read(text: str) -> bool:
+    return text.lstrip().upper().startswith(("SELECT", "WITH")) and _WRITE_STATEMENT.search(text) is None
+
+class QueryProfiler:
+    """
+    Ring buffer of the statements slower than a threshold, with their parameters.
+    A sample of the slow reads is run again with EXPLAIN (ANALYZE, BUFFERS) on a separate
+    connection, one at a time, so the request that was slow is not slowed down further.
+    """
+    def __init__(
+        self,
+        threshold_ms: float = QUERY_PROFILER_THRESHOLD_MS,
+        explain_rate: float = QUERY_PROFILER_EXPLAIN_RATE,
+        buffer_size: int = QUERY_PROFILER_BUFFER_SIZE
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.entries: deque[dict] = deque(maxlen=buffer_size)
+        self.recorded = 0
+        self.explained = 0
+        self._pool: Optional[AsyncConnectionPool] = None
+        self._explain_task: Optional[asyncio.Task] = None
+
+    def start(self, pool: AsyncConnectionPool):
+        self._pool = pool
+
+    async def stop(self):
+        self._pool = None
+        if self._explain_task is not None:
+            self._explain_task.cancel()
+            try:
+                await self._explain_task
+            except asyncio.CancelledError:
+                pass
+            self._explain_task = None
+
+    def clear(self):
+        self.entries.clear()
+
+    def record(self, conn: psycopg.AsyncConnection, query: Any, params: Any, duration_ms: float):
+        text = _query_text(query, conn)
+        entry = {
+            "timestamp": int(time.time()),
+            "duration_ms": round(duration_ms, 3),
+            "query": text,
+            "params": _format_params(params),
+            "plan": None,
+        }
+        self.entries.append(entry)
+        self.recorded += 1
+        explaining = self._explain_task is not None and not self._explain_task.done()
+        if self._pool is not None and not explaining and _is_read(text) and random.random() < self.explain_rate:
+            self._explain_task = asyncio.create_task(self._explain(entry, query, params))
+
+    async def _explain(self, entry: dict, query: Any, params: Any):
+        if isinstance(query, (str, bytes)):
+            query = sql.SQL(_query_text(query, None))
+        statement = sql.SQL("EXPLAIN (ANALYZE, BUFFERS) ") + query
+        try:
+            async with self._pool.connection() as conn:
+                # A plain cursor, so the EXPLAIN itself is not profiled
+                async with psycopg.AsyncCursor(conn) as cur:
+                    await cur.execute(sql.SQL("SET LOCAL statement_timeout = {}").format(QUERY_PROFILER_EXPLAIN_TIMEOUT_MS))
+                    await cur.execute(statement, params)
+                    entry["plan"] = "\n".join(row[0] for row in await cur.fetchall())
+                await conn.rollback()
+            self.explained += 1
+        except Exception as e:
+            logger.warning(f"Error explaining slow query: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": QUERY_PROFILER_ENABLED,
+            "threshold_ms": self.threshold_ms,
+            "explain_rate": self.explain_rate,
+            "recorded": self.recorded,
+            "explained": self.explained,
+        }
+
+profiler = QueryProfiler()
+
+class ProfilingCursor(psycopg.AsyncCursor):
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            if duration_ms >= profiler.threshold_ms:
+                profiler.record(self.connection, query, params, duration_ms)
+
+class ProfilingServerCursor(psycopg.AsyncServerCursor):
+    """
+    Declaring a server side cursor is cheap, the work happens while fetching,
+    so the time spent in every call is added up and the statement is recorded on close.
+    """
+    _profile_query: Any = None
+    _profile_params: Any = None
+    _profile_ms: float = 0.0
+
+    async def _timed(self, call):
+        start = time.perf_counter()
+        try:
+            return await call
+        finally:
+            self._profile_ms += (time.perf_counter() - start) * 1000
+
+    async def execute(self, query, params=None, **kwargs):
+        self._profile_query, self._profile_params, self._profile_ms = query, params, 0.0
+        return await self._timed(super().execute(query, params, **kwargs))
+
+    async def fetchone(self):
+        return await self._timed(super().fetchone())
+
+    async def fetchmany(self, size: int = 0):
+        return await self._timed(super().fetchmany(size))
+
+    async def fetchall(self):
+        return await self._timed(super().fetchall())
+
+    async def close(self):
+        if self._profile_query is not None and self._profile_ms >= profiler.threshold_ms:
+            profiler.record(self.connection, self._profile_query, self._profile_params, self._profile_ms)
+        self._profile_query = None
+        await super().close()
+
+async def configure_profiling(conn: psycopg.AsyncConnection):
+    """
+    Pool `configure` callback making every cursor of a new connection report its slow statements.
+    """
+    conn.cursor_factory = ProfilingCursor
+    conn.server_cursor_factory = ProfilingServerCursor
@@ -0,0 +1,350 @@
+import datetime
+from typing import AsyncIterator, Optional
+
+import numpy as np
+import psycopg
+import psycopg.rows
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+
+from metrics import db_timer
+from settings import settings_cache
+
+BUCKETS = 100 # default number of buckets returned for a time window
+MAX_POINTS = 5000 # max number of points a client can ask for
+LTTB_OVERSAMPLING = 16 # input samples per output point fed to LTTB
+SERIES_CHUNK_ROWS = 50_000 # rows fetched at a time when reading a full series
+
+# Continuous aggregates maintained by the database, coarsest first: (view, granularity)
+ROLLUPS = [
+    ("readings_daily", datetime.timedelta(days=1)),
+    ("readings_hourly", datetime.timedelta(hours=1)),
+]
+
+RAW_AGGREGATES = sql.SQL("""
+    avg(humidity)    AS humidity,
+    avg(temperature) AS temperature,
+    avg(battery)     AS battery,
+    min(humidity)    AS humidity_min,
+    max(humidity)    AS humidity_max,
+    min(temperature) AS temperature_min,
+    max(temperature) AS temperature_max,
+    min(battery)     AS battery_min,
+    max(battery)     AS battery_max,
+    count(*)         AS samples""")
+
+# Rollups store one average per bucket, so they are weighted back by their sample count
+ROLLUP_AGGREGATES = sql.SQL("""
+    sum(humidity_avg * humidity_count) / NULLIF(sum(humidity_count), 0)          AS humidity,
+    sum(temperature_avg * temperature_count) / NULLIF(sum(temperature_count), 0) AS temperature,
+    sum(battery_avg * battery_count) / NULLIF(sum(battery_count), 0)             AS battery,
+    min(humidity_min)    AS humidity_min,
+    max(humidity_max)    AS humidity_max,
+    min(temperature_min) AS temperature_min,
+    max(temperature_max) AS temperature_max,
+    min(battery_min)     AS battery_min,
+    max(battery_max)     AS battery_max,
+    sum(samples)         AS samples""")
+
+Horizons = tuple[Optional[datetime.datetime], Optional[datetime.datetime]]
+
+def pick_rollup(
+    bucket_width: datetime.timedelta,
+    start_time: Optional[datetime.datetime] = None,
+    horizons: Optional[Horizons] = None
+) -> Optional[tuple[str, datetime.timedelta]]:
+    """
+    Get the coarsest rollup that still has at least one row per bucket, None if raw rows are needed.
+    With the retention `horizons` of the raw and hourly tiers, a coarser rollup is used
+    when the finer data at `start_time` has already been dropped.
+    """
+    minimum = datetime.timedelta(0)
+    if start_time is not None and horizons is not None:
+        raw_horizon, hourly_horizon = horizons
+        if hourly_horizon is not None and start_time < hourly_horizon:
+            minimum = datetime.timedelta(days=1)
+        elif raw_horizon is not None and start_time < raw_horizon:
+            minimum = datetime.timedelta(hours=1)
+    for view, granularity in ROLLUPS:
+        if bucket_width >= granularity or granularity <= minimum:
+            return view, granularity
+    return None
+
+def floor_time(timestamp: datetime.datetime, granularity: datetime.timedelta) -> datetime.datetime:
+    """
+    Align a timestamp to the start of its bucket, the same way `time_bucket` does for hours and days.
+    """
+    epoch = timestamp.timestamp()
+    step = granularity.total_seconds()
+    return datetime.datetime.fromtimestamp(epoch - epoch % step, tz=datetime.timezone.utc)
+
+def mac_filter(mac: Optional[str | list[str]]) -> sql.Composable:
+    """
+    Build the condition selecting one sensor, a list of sensors, or every sensor (None).
+    """
+    if mac is None:
+        return sql.SQL("TRUE")
+    if isinstance(mac, str):
+        return sql.SQL("mac = {}").format(mac)
+    return sql.SQL("mac = ANY({})").format(list(mac))
+
+async def retention_active(conn: psycopg.AsyncConnection) -> bool:
+    """
+    Whether raw readings are dropped by a retention policy, so that the rollups have to be looked at as well.
+    The validation of the tiers guarantees that nothing is dropped while raw readings are kept forever.
+    Served from the settings cache.
+    """
+    settings = await settings_cache.get(conn)
+    return settings.raw_retention_days > 0
+
+async def fetch_horizons(conn: psycopg.AsyncConnection, mac: Optional[str | list[str]]) -> Horizons:
+    """
+    Get the retention horizons of one or more sensors: the oldest raw reading and the oldest hourly
+    rollup still kept, each None if nothing older was dropped from that tier.
+    When several sensors are selected, the most recent horizon of each tier is returned.
+    A tier is considered dropped where the next coarser one has rows older than all of its own.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute(sql.SQL("""
+            SELECT
+                max(coalesce(r.start, now())) FILTER (WHERE h.start < date_trunc('hour', coalesce(r.start, now()))),
+                max(coalesce(h.start, now())) FILTER (WHERE d.start < date_trunc('day', coalesce(h.start, now())))
+            FROM sensors s
+            CROSS JOIN LATERAL (SELECT min(timestamp) AS start FROM readings WHERE readings.mac = s.mac) r
+            CROSS JOIN LATERAL (SELECT min(bucket) AS start FROM readings_hourly WHERE readings_hourly.mac = s.mac) h
+            CROSS JOIN LATERAL (SELECT min(bucket) AS start FROM readings_daily WHERE readings_daily.mac = s.mac) d
+            WHERE {mac_filter}""").format(mac_filter=mac_filter(mac)))
+        row = await cur.fetchone()
+    return (row[0], row[1]) if row is not None else (None, None)
+
+def tiered_readings(mac: str, tiered: bool = True) -> sql.Composable:
+    """
+    Subquery with the readings of a sensor across the retention tiers: the raw readings, then
+    the hourly averages older than the oldest raw reading, then the daily averages older than
+    the oldest hourly one. Without retention (`tiered` False) it is just the raw readings.
+    """
+    if not tiered:
+        return sql.SQL("""(
+            SELECT mac, timestamp, humidity, temperature, battery
+            FROM readings
+            WHERE mac = {mac}
+        ) AS tiered""").format(mac=mac)
+    return sql.SQL("""(
+        WITH starts AS (
+            SELECT
+                (SELECT min(timestamp) FROM readings WHERE mac = {mac}) AS raw_start,
+                (SELECT min(bucket) FROM readings_hourly WHERE mac = {mac}) AS hourly_start
+        )
+        SELECT mac, timestamp, humidity, temperature, battery
+        FROM readings
+        WHERE mac = {mac}
+        UNION ALL
+        SELECT mac, bucket, humidity_avg, temperature_avg, battery_avg
+        FROM readings_hourly, starts
+        WHERE mac = {mac} AND bucket < date_trunc('hour', coalesce(raw_start, 'infinity'))
+        UNION ALL
+        SELECT mac, bucket, humidity_avg, temperature_avg, battery_avg
+        FROM readings_daily, starts
+        WHERE mac = {mac} AND bucket < date_trunc('day', coalesce(hourly_start, raw_start, 'infinity'))
+    ) AS tiered""").format(mac=mac)
+
+def time_conditions(column: str, start: Optional[int], end: Optional[int]) -> list[sql.Composable]:
+    conditions = []
+    if start is not None:
+        conditions.append(sql.SQL("{} >= to_timestamp({})").format(sql.Identifier(column), start))
+    if end is not None:
+        conditions.append(sql.SQL("{} <= to_timestamp({})").format(sql.Identifier(column), end))
+    return conditions
+
+async def fetch_bounds(
+    cur: psycopg.AsyncCursor,
+    mac: Optional[str | list[str]],
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> Optional[tuple[datetime.datetime, datetime.datetime]]:
+    """
+    Get the first and last reading timestamps of one or more sensors, optionally within unix timestamp bounds.
+    With retention enabled, readings already dropped by the policies are still found in the rollups:
+    the start is taken from a coarser tier only where the finer one has been dropped, like `tiered_readings` does.
+    Returns None if there are no readings.
+    The cursor must use the dict row factory.
+    """
+    raw = sql.SQL(" AND ").join([mac_filter(mac), *time_conditions("timestamp", start, end)])
+    if not await retention_active(cur.connection):
+        await cur.execute(sql.SQL("""
+            SELECT min(timestamp) AS start_time, max(timestamp) AS end_time
+            FROM readings
+            WHERE {raw}""").format(raw=raw))
+    else:
+        rollup = sql.SQL(" AND ").join([mac_filter(mac), *time_conditions("bucket", start, end)])
+        await cur.execute(sql.SQL("""
+            SELECT
+                CASE
+                    WHEN d.start_time < date_trunc('day', coalesce(h.start_time, r.start_time, 'infinity')) THEN d.start_time
+                    WHEN h.start_time < date_trunc('hour', coalesce(r.start_time, 'infinity')) THEN h.start_time
+                    ELSE r.start_time
+                END AS start_time,
+                greatest(r.end_time, h.end_time, d.end_time) AS end_time
+            FROM (SELECT min(timestamp) AS start_time, max(timestamp) AS end_time FROM readings WHERE {raw}) r,
+                 (SELECT min(bucket) AS start_time, max(bucket) AS end_time FROM readings_hourly WHERE {rollup}) h,
+                 (SELECT min(bucket) AS start_time, max(bucket) AS end_time FROM readings_daily WHERE {rollup}) d
+            """).format(raw=raw, rollup=rollup))
+    row = await cur.fetchone()
+    if row is None or row['start_time'] is None:
+        return None
+    return row['start_time'], row['end_time']
+
+async def fetch_buckets(
+    cur: psycopg.AsyncCursor,
+    mac: Optional[str | list[str]],
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    buckets: int = BUCKETS
+):
+    """
+    Aggregate the readings of one or more sensors between two timestamps into (at most) `buckets` buckets.
+    Each bucket holds the average, min and max of every value and the number of readings.
+    Wide buckets are computed from the continuous aggregates instead of the raw readings,
+    and so are windows starting before the raw readings still kept.
+    When several sensors are selected, rows are grouped by sensor as well and every sensor
+    shares the same bucket boundaries.
+    Rows are returned newest first.
+    """
+    bucket_width = datetime.timedelta(seconds=max(int((end_time - start_time).total_seconds() / buckets), 1))
+    rollup = pick_rollup(bucket_width)
+    # Only when retention is enabled can the finer tiers be missing part of the window
+    if (rollup is None or rollup[0] != ROLLUPS[0][0]) and await retention_active(cur.connection):
+        rollup = pick_rollup(bucket_width, start_time, await fetch_horizons(cur.connection, mac))
+    if rollup is None:
+        table = sql.Identifier("readings")
+        time_column = sql.Identifier("timestamp")
+        aggregates = RAW_AGGREGATES
+        range_start = start_time
+    else:
+        view, granularity = rollup
+        table = sql.Identifier(view)
+        time_column = sql.Identifier("bucket")
+        aggregates = ROLLUP_AGGREGATES
+        # Include the rollup bucket the window starts in
+        range_start = floor_time(start_time, granularity)
+    query = sql.SQL("""
+        SELECT
+            mac,
+            EXTRACT(EPOCH FROM time_bucket(%(width)s, {time_column}, %(origin)s)) AS timestamp,{aggregates}
+        FROM {table}
+        WHERE {mac_filter}
+        AND {time_column} >= %(range_start)s
+        AND {time_column} <= %(end)s
+        GROUP BY 1, 2
+        ORDER BY timestamp DESC, mac""").format(
+            time_column=time_column,
+            aggregates=aggregates,
+            table=table,
+            mac_filter=mac_filter(mac)
+        )
+    with db_timer("bucket_aggregate"):
+        await cur.execute(query, {
+            "width": bucket_width,
+            "origin": range_start,
+            "range_start": range_start,
+            "end": end_time,
+        })
+        return await cur.fetchall()
+
+async def fetch_series(
+    cur: psycopg.AsyncCursor,
+    mac: str,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    resolution: datetime.timedelta
+) -> np.ndarray:
+    """
+    Read the readings of a sensor between two timestamps as a (n, 4) float array of
+    (timestamp, humidity, temperature, battery) rows, oldest first, with NaN for missing values.
+    Rollup averages are used instead of raw readings when `resolution` allows it,
+    or when the raw readings at `start_time` have been dropped.
+    """
+    rollup = pick_rollup(resolution)
+    # Only when retention is enabled can the finer tiers be missing part of the window
+    if (rollup is None or rollup[0] != ROLLUPS[0][0]) and await retention_active(cur.connection):
+        rollup = pick_rollup(resolution, start_time, await fetch_horizons(cur.connection, mac))
+    if rollup is None:
+        query = sql.SQL("""
+            SELECT EXTRACT(EPOCH FROM timestamp)::float8, humidity, temperature, battery
+            FROM readings
+            WHERE mac = %(mac)s AND timestamp >= %(start)s AND timestamp <= %(end)s
+            ORDER BY timestamp""")
+        range_start = start_time
+    else:
+        view, granularity = rollup
+        query = sql.SQL("""
+            SELECT EXTRACT(EPOCH FROM bucket)::float8, humidity_avg, temperature_avg, battery_avg
+            FROM {table}
+            WHERE mac = %(mac)s AND bucket >= %(start)s AND bucket <= %(end)s
+            ORDER BY bucket""").format(table=sql.Identifier(view))
+        range_start = floor_time(start_time, granularity)
+    chunks = []
+    with db_timer("series"):
+        await cur.execute(query, {"mac": mac, "start": range_start, "end": end_time})
+        while True:
+            rows = await cur.fetchmany(SERIES_CHUNK_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64))
+    if not chunks:
+        return np.empty((0, 4), dtype=np.float64)
+    return np.concatenate(chunks)
+
+class NoReadings(LookupError):
+    pass
+
+async def start_stream(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Run a stream up to its first chunk and return it whole again,
+    so that errors found before any data is sent (like NoReadings) are raised while a response can still be chosen.
+    """
+    try:
+        first = await anext(stream)
+    except StopAsyncIteration:
+        first = None
+
+    async def resume() -> AsyncIterator[bytes]:
+        if first is not None:
+            yield first
+        async for chunk in stream:
+            yield chunk
+    return resume()
+
+async def stream_csv(
+    pool: AsyncConnectionPool,
+    mac: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None
+) -> AsyncIterator[bytes]:
+    """
+    Stream the readings of a sensor as CSV, newest first, using `COPY ... TO STDOUT`.
+    Readings dropped by the retention policies are replaced by the averages of the rollups still kept.
+    The connection is taken from the pool for the duration of the stream,
+    since the response outlives the request handler.
+    Raises NoReadings before the first chunk if there are no readings, see `start_stream`.
+    """
+    conditions = time_conditions("timestamp", start, end) or [sql.SQL("TRUE")]
+    async with pool.connection() as conn:
+        async with conn.cursor(row_factory=psycopg.rows.dict_row) as cur:
+            # Also finds readings only kept in the rollups
+            if await fetch_bounds(cur, mac, start, end) is None:
+                raise NoReadings(mac)
+        query = sql.SQL("""
+            COPY (
+                SELECT mac, to_char(timestamp, 'YYYY-MM-DD HH24:MI:SS') AS timestamp, humidity, temperature, battery
+                FROM {readings}
+                WHERE {conditions}
+                ORDER BY tiered.timestamp DESC
+            ) TO STDOUT WITH (FORMAT csv, HEADER)""").format(
+                readings=tiered_readings(mac, await retention_active(conn)),
+                conditions=sql.SQL(" AND ").join(conditions)
+            )
+        async with conn.cursor() as cur:
+            async with cur.copy(query) as copy:
+                async for chunk in copy:
+                    yield bytes(chunk)
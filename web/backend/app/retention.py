@@ -0,0 +1,47 @@
+import datetime
+
+import psycopg
+from psycopg import sql
+
+from models import GlobalSettingsProps
+
+# Raw readings must outlive the widest continuous aggregate refresh window (7 days),
+# otherwise a refresh over dropped chunks would wipe the rollups computed from them
+MIN_RAW_RETENTION_DAYS = 8
+
+# Finest first: (relation, settings field, settings key)
+RETENTION_TIERS = [
+    ("readings", "raw_retention_days", "raw-retention-days"),
+    ("readings_hourly", "hourly_retention_days", "hourly-retention-days"),
+    ("readings_daily", "daily_retention_days", "daily-retention-days"),
+]
+
+def validate_retention(settings: GlobalSettingsProps):
+    """
+    Check that the retention tiers are consistent, raises ValueError otherwise.
+    Every tier must be kept at least as long as the finer ones, 0 (forever) included.
+    """
+    if 0 < settings.raw_retention_days < MIN_RAW_RETENTION_DAYS:
+        raise ValueError(f"Raw readings must be kept for at least {MIN_RAW_RETENTION_DAYS} days")
+    previous = None
+    for _, field, _ in RETENTION_TIERS:
+        days = getattr(settings, field)
+        if previous is not None and days != 0 and (previous == 0 or days < previous):
+            raise ValueError("Every rollup must be kept at least as long as the finer data it summarizes")
+        previous = days
+
+async def apply_retention(db: psycopg.AsyncConnection, settings: GlobalSettingsProps):
+    """
+    Store the retention tiers and replace the TimescaleDB retention policies accordingly,
+    in the current transaction. The policies drop whole chunks in the background.
+    """
+    async with db.cursor() as cur:
+        for relation, field, key in RETENTION_TIERS:
+            days = getattr(settings, field)
+            await cur.execute(
+                "INSERT INTO settings (key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                (key, str(days)))
+            await cur.execute(sql.SQL("SELECT remove_retention_policy({}, if_exists => true)").format(relation))
+            if days > 0:
+                await cur.execute(sql.SQL("SELECT add_retention_policy({}, drop_after => {})").format(
+                    relation, datetime.timedelta(days=days)))
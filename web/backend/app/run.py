@@ -6,8 +6,49 @@ import colorlog
 
 PORT = int(os.getenv("BACKEND_PORT", "8000"))
 MODE = os.getenv("MODE", "development")
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0")) # API processes in production, 0 runs one per available core
+GRACEFUL_SHUTDOWN_S = int(os.getenv("GRACEFUL_SHUTDOWN_S", "30")) # time given to in-flight requests and ingest flushes on shutdown
+
+def worker_count() -> int:
+    if WEB_WORKERS > 0:
+        return WEB_WORKERS
+    # Honors the CPU affinity of the container, unlike os.cpu_count
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def run_production(workers: int, log_config: dict):
+    """
+    Run the API with gunicorn and uvicorn workers.
+    The app is imported once before forking, so a broken build fails before any worker starts,
+    and workers that die are replaced.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            options = {
+                "bind": f"0.0.0.0:{PORT}",
+                "workers": workers,
+                "worker_class": "uvicorn_worker.UvicornWorker",
+                "preload_app": True,
+                "graceful_timeout": GRACEFUL_SHUTDOWN_S,
+                "logconfig_dict": log_config,
+            }
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+    Server().run()
 
 if __name__ == "__main__":
+    workers = worker_count() if MODE == "production" else 1
+    # Read by the app to split the connection budget and relay events between workers
+    os.environ["WEB_WORKERS"] = str(workers)
+
     # Create custom logging config for uvicorn
     log_config = {
         "version": 1,
@@ -55,14 +96,29 @@ if __name__ == "__main__":
                 "level": "INFO", 
                 "propagate": False
             },
+            # Gunicorn loggers - worker management in production
+            "gunicorn.error": {
+                "handlers": ["default"],
+                "level": "INFO",
+                "propagate": False
+            },
+            "gunicorn.access": {
+                "handlers": ["default"],
+                "level": "INFO",
+                "propagate": False
+            },
         },
     }
-    
-    uvicorn.run(
-        "app:app", 
-        host="0.0.0.0", 
-        port=PORT, 
-        reload=(MODE == "development"),
-        reload_delay=1,
-        log_config=log_config
-    )
+
+    if MODE == "production":
+        run_production(workers, log_config)
+    else:
+        uvicorn.run(
+            "app:app", 
+            host="0.0.0.0", 
+            port=PORT, 
+            reload=(MODE == "development"),
+            reload_delay=1,
+            timeout_graceful_shutdown=GRACEFUL_SHUTDOWN_S,
+            log_config=log_config
+        )
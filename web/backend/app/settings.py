@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from typing import Optional
+
+import psycopg
+import psycopg.rows
+from psycopg_pool import AsyncConnectionPool
+
+from db import CONNINFO
+from metrics import db_timer
+from models import GlobalSettingsProps
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_CHANNEL = "settings_changed" # NOTIFY channel used to invalidate the cache in every worker
+LISTEN_RETRY_S = 5 # wait time before reconnecting the listener
+
+async def load_settings(db: psycopg.AsyncConnection) -> GlobalSettingsProps:
+    """
+    Read and parse the global settings from the database.
+    """
+    async with db.cursor(row_factory=psycopg.rows.dict_row) as cur:
+        with db_timer("settings"):
+            await cur.execute("SELECT key, value FROM settings")
+            rows = await cur.fetchall()
+        settings_dict = {row['key']: row['value'] for row in rows}
+        sync_time = settings_dict.get('sync-time', '12:00')
+        sync_hour, sync_minute = map(int, sync_time.split(':'))
+        return GlobalSettingsProps(
+            sync_time=(sync_hour, sync_minute),
+            battery_warning_threshold=float(settings_dict.get('battery-warning-threshold', 3.3)),
+            battery_critical_threshold=float(settings_dict.get('battery-critical-threshold', 3.0)),
+            max_latency=int(settings_dict.get('max-latency', 86400)),
+            raw_retention_days=int(settings_dict.get('raw-retention-days', 0)),
+            hourly_retention_days=int(settings_dict.get('hourly-retention-days', 0)),
+            daily_retention_days=int(settings_dict.get('daily-retention-days', 0))
+        )
+
+async def notify_settings_changed(db: psycopg.AsyncConnection):
+    """
+    Tell every process that the settings changed, delivered when the current transaction commits.
+    """
+    await db.execute("SELECT pg_notify(%s, '')", (SETTINGS_CHANNEL,))
+
+class SettingsCache:
+    """
+    In-process cache of the parsed global settings.
+    The cache is invalidated through LISTEN/NOTIFY, and it is bypassed whenever
+    the listener is not connected so that stale values are never served.
+    """
+    def __init__(self):
+        self._settings: Optional[GlobalSettingsProps] = None
+        self._version = 0
+        self._listening = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def version(self) -> int:
+        """
+        Counter bumped every time the cached settings are invalidated.
+        """
+        return self._version
+
+    def cached(self) -> Optional[GlobalSettingsProps]:
+        """
+        Get the cached settings, or None if they must be loaded from the database.
+        """
+        return self._settings if self._listening else None
+
+    async def get(self, db: psycopg.AsyncConnection) -> GlobalSettingsProps:
+        settings = self.cached()
+        if settings is not None:
+            return settings
+        version = self._version
+        settings = await load_settings(db)
+        # Do not cache a value that was invalidated while it was being loaded
+        if version == self._version:
+            self._settings = settings
+        return settings
+
+    async def get_pooled(self, pool: AsyncConnectionPool) -> GlobalSettingsProps:
+        """
+        Same as `get`, but a connection is only checked out of the pool on a cache miss.
+        """
+        settings = self.cached()
+        if settings is not None:
+            return settings
+        async with pool.connection() as db:
+            return await self.get(db)
+
+    def invalidate(self):
+        self._settings = None
+        self._version += 1
+
+    async def start(self):
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._listening = False
+
+    async def _listen(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(CONNINFO, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {SETTINGS_CHANNEL}")
+                    # Anything could have changed while we were not listening
+                    self.invalidate()
+                    self._listening = True
+                    async for _ in conn.notifies():
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Settings listener disconnected: {e}")
+            self._listening = False
+            self.invalidate()
+            await asyncio.sleep(LISTEN_RETRY_S)
+
+settings_cache = SettingsCache()
@@ -0,0 +1,64 @@
+import os
+import time
+import uuid
+from typing import Iterable, Optional
+
+import fastapi
+
+from events import worker_events
+
+ETAG_TIME_QUANTUM_S = 60 # responses depending on the current time (online status, sliding windows) expire this often
+
+class Watermarks:
+    """
+    Counters bumped every time the data behind the polling endpoints changes,
+    globally and for each sensor, used to build cheap ETags.
+    Every worker has its own counters, bumps are relayed to the other workers.
+    """
+    def __init__(self):
+        self.renew()
+        self.version = 0
+        self._sensors: dict[str, int] = {}
+        # Forked workers must not share the epoch of the process that imported the app
+        os.register_at_fork(after_in_child=self.renew)
+
+    def renew(self):
+        """
+        Change the epoch, invalidating every ETag handed out so far.
+        Distinguishes the counters of this process from the ones of a previous run or of another worker.
+        """
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def bump(self, macs: Iterable[str] = (), relay: bool = True):
+        self.version += 1
+        macs = list(macs)
+        for mac in macs:
+            self._sensors[mac] = self.version
+        if relay:
+            worker_events.send("watermarks", {"macs": macs})
+
+    def sensor(self, mac: str) -> int:
+        return self._sensors.get(mac, 0)
+
+watermarks = Watermarks()
+worker_events.on("watermarks", lambda data: watermarks.bump(data["macs"], relay=False))
+# Bumps may have been missed while the listener was disconnected
+worker_events.on_resync(watermarks.renew)
+
+def check_etag(request: fastapi.Request, response: fastapi.Response, *parts, exists: bool = True) -> Optional[fastapi.Response]:
+    """
+    Compute the ETag of a response from the current watermark `parts` and the current time quantum.
+    Returns a 304 response if the client already has it, otherwise sets the ETag header on `response`.
+    Needs no database connection, so it should run before one is taken from the pool.
+    `If-None-Match: *` only matches when the resource is known to `exist`; endpoints that may answer 404
+    check again once they have found it.
+    """
+    quantum = int(time.time()) // ETAG_TIME_QUANTUM_S
+    etag = 'W/"' + "-".join(str(part) for part in (watermarks.epoch, *parts, quantum)) + '"'
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if etag in tags or (exists and "*" in tags):
+            return fastapi.Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
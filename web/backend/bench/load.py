@@ -0,0 +1,186 @@
+"""
+Load generator for the GardenEye backend.
+
+Simulates a fleet of sensor nodes following the firmware protocol (register, time sync,
+then periodic uploads of buffered readings) together with dashboard clients polling the
+sensor list, the info panel and the readings charts, and reports throughput and latency
+percentiles for every endpoint.
+
+    python load.py --url http://localhost:8000 --nodes 200 --dashboards 20 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import time
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+import numpy as np
+
+SAMPLING_INTERVAL_S = 20 # same as the firmware
+BATCH_SIZE = 24 # readings buffered by a node before uploading them
+BINARY_CONTENT_TYPE = "application/vnd.gardeneye.readings"
+PERIODS = [3600, 86400, 7 * 86400, 30 * 86400] # chart windows picked by the dashboards
+
+class Recorder:
+    """
+    Latencies and outcomes of every request, grouped by endpoint.
+    """
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    async def request(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        self.statuses[name][response.status_code] += 1
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+    def report(self) -> dict:
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {}
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            latencies = np.array(self.latencies[name]) if self.latencies[name] else np.zeros(1)
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            report[name] = {
+                "requests": len(self.latencies[name]),
+                "rps": len(self.latencies[name]) / elapsed,
+                "errors": self.errors[name],
+                "statuses": dict(self.statuses[name]),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": float(latencies.max()),
+            }
+        return report
+
+def print_report(report: dict):
+    header = f"{'endpoint':<28}{'requests':>10}{'rps':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, row in report.items():
+        print(
+            f"{name:<28}{row['requests']:>10}{row['rps']:>10.1f}{row['errors']:>8}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+
+def node_mac(index: int) -> str:
+    # Locally administered addresses, so they never collide with real boards
+    return "02:be:" + ":".join(f"{b:02x}" for b in index.to_bytes(4, "big"))
+
+class VirtualNode:
+    def __init__(self, index: int, token: str, binary: bool):
+        self.mac = node_mac(index)
+        self.headers = {"MAC": self.mac, "Authorization": f"Bearer {token}"}
+        self.binary = binary
+        self.rng = random.Random(index)
+        self.clock = 0 # node uptime in seconds, like the firmware's RTC before the time sync
+        self.humidity = self.rng.uniform(20, 80)
+        self.temperature = self.rng.uniform(10, 30)
+        self.battery = self.rng.uniform(3.6, 4.2)
+
+    def sample(self) -> tuple[int, float, float, float]:
+        self.clock += SAMPLING_INTERVAL_S
+        self.humidity = min(100.0, max(0.0, self.humidity + self.rng.gauss(0, 0.5)))
+        self.temperature += self.rng.gauss(0, 0.1)
+        self.battery = max(3.0, self.battery - abs(self.rng.gauss(0, 0.0005)))
+        return self.clock, self.humidity, self.temperature, self.battery
+
+    def payload(self, batch: int) -> tuple[bytes, str]:
+        samples = [self.sample() for _ in range(batch)]
+        if self.binary:
+            body = struct.pack("<Q", self.clock) + b"".join(struct.pack("<Qfff", *s) for s in samples)
+            return body, BINARY_CONTENT_TYPE
+        timestamps, humidity, temperature, battery = (list(column) for column in zip(*samples))
+        body = json.dumps({
+            "timestamps": timestamps,
+            "humidity": humidity,
+            "temperature": temperature,
+            "battery": battery,
+            "now": self.clock,
+        }).encode()
+        return body, "application/json"
+
+    async def run(self, client: httpx.AsyncClient, recorder: Recorder, args: argparse.Namespace, deadline: float):
+        # Nodes boot at different times
+        await asyncio.sleep(self.rng.uniform(0, args.upload_interval))
+        await recorder.request(client, "POST /api/register", "POST", "/api/register", headers=self.headers)
+        await recorder.request(client, "GET /api/time", "GET", "/api/time")
+        while time.perf_counter() < deadline:
+            body, content_type = self.payload(args.batch)
+            await recorder.request(
+                client, "POST /api/readings", "POST", "/api/readings",
+                content=body, headers={**self.headers, "Content-Type": content_type})
+            await asyncio.sleep(args.upload_interval * self.rng.uniform(0.9, 1.1))
+
+async def run_dashboard(index: int, client: httpx.AsyncClient, recorder: Recorder, args: argparse.Namespace, deadline: float):
+    rng = random.Random(-index - 1)
+    etags: dict[str, str] = {}
+
+    async def poll(name: str, url: str, params: Optional[dict] = None):
+        key = url + json.dumps(params, sort_keys=True)
+        headers = {"If-None-Match": etags[key]} if args.etags and key in etags else {}
+        response = await recorder.request(client, name, "GET", url, params=params, headers=headers)
+        if response is not None and "etag" in response.headers:
+            etags[key] = response.headers["etag"]
+        return response
+
+    await asyncio.sleep(rng.uniform(0, args.dashboard_interval))
+    macs: list[str] = []
+    while time.perf_counter() < deadline:
+        response = await poll("GET /api/sensors", "/api/sensors")
+        if response is not None and response.status_code == 200:
+            macs = [sensor["mac"] for sensor in response.json()]
+        await poll("GET /api/info", "/api/info")
+        for mac in rng.sample(macs, min(args.charts, len(macs))):
+            await poll("GET /api/readings", "/api/readings", {"mac": mac, "period": rng.choice(PERIODS)})
+        await asyncio.sleep(args.dashboard_interval * rng.uniform(0.9, 1.1))
+
+async def main(args: argparse.Namespace) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        deadline = time.perf_counter() + args.duration
+        nodes = [VirtualNode(i, args.token, args.binary) for i in range(args.nodes)]
+        tasks = [node.run(client, recorder, args, deadline) for node in nodes]
+        tasks += [run_dashboard(i, client, recorder, args, deadline) for i in range(args.dashboards)]
+        await asyncio.gather(*tasks)
+    recorder.finished = time.perf_counter()
+    return recorder.report()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate sensor nodes and dashboards against a GardenEye backend")
+    parser.add_argument("--url", default=f"http://localhost:{os.getenv('BACKEND_PORT', '8000')}", help="Base URL of the backend")
+    parser.add_argument("--token", default=os.getenv("API_KEY", ""), help="API key used by the nodes")
+    parser.add_argument("--nodes", type=int, default=100, help="Number of virtual sensor nodes")
+    parser.add_argument("--dashboards", type=int, default=10, help="Number of polling dashboard clients")
+    parser.add_argument("--duration", type=float, default=60, help="Test duration in seconds")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="Readings per upload")
+    parser.add_argument("--upload-interval", type=float, default=10, help="Seconds between uploads of a node (the firmware waits batch * 20s)")
+    parser.add_argument("--dashboard-interval", type=float, default=5, help="Seconds between dashboard refreshes")
+    parser.add_argument("--charts", type=int, default=3, help="Readings charts loaded by each dashboard refresh")
+    parser.add_argument("--binary", action="store_true", help="Upload readings in the packed binary format instead of JSON")
+    parser.add_argument("--etags", action="store_true", help="Revalidate dashboard polls with If-None-Match like a browser")
+    parser.add_argument("--connections", type=int, default=100, help="Maximum concurrent HTTP connections")
+    parser.add_argument("--timeout", type=float, default=30, help="Request timeout in seconds")
+    parser.add_argument("--json", help="Also write the report to this file, to compare runs")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "endpoints": report}, f, indent=2)
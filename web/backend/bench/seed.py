@@ -0,0 +1,110 @@
+"""
+Seed a GardenEye database with synthetic sensor histories for benchmarking.
+
+Every sensor replays the humidity, temperature and battery patterns recorded by a real board
+(`embedded/battery/readings_01.csv`), shifted, scaled and with some noise, so that queries
+and compression behave like they would on real data.
+
+    python seed.py --sensors 50 --days 90
+"""
+import argparse
+import asyncio
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import psycopg
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = int(os.getenv("DB_PORT", "5432"))
+DB_USER = os.getenv("DB_USER", "root")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+
+SAMPLING_INTERVAL_S = 20 # same as the firmware
+SOURCE_CSV = Path(__file__).resolve().parents[3] / "embedded" / "battery" / "readings_01.csv"
+MIN_VOLTAGE = 3.0
+MAX_VOLTAGE = 4.2
+COPY_CHUNK_ROWS = 100_000
+
+def seed_mac(index: int) -> str:
+    # Locally administered addresses, distinct from the ones used by load.py
+    return "02:5e:" + ":".join(f"{b:02x}" for b in index.to_bytes(4, "big"))
+
+def load_patterns(path: Path) -> np.ndarray:
+    """
+    Humidity, temperature and battery columns of the recorded CSV, oldest first, as a (n, 3) array.
+    The battery is rescaled to the voltage range of the cells.
+    """
+    data = np.genfromtxt(path, delimiter=",", skip_header=1, usecols=(2, 3, 4))
+    data = data[::-1]
+    battery = data[:, 2]
+    data[:, 2] = MIN_VOLTAGE + (battery - battery.min()) * (MAX_VOLTAGE - MIN_VOLTAGE) / (battery.max() - battery.min())
+    return data
+
+def synthesize(patterns: np.ndarray, samples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    A (samples, 3) history that tiles the recorded patterns with a random phase, offset and noise.
+    """
+    offset = rng.integers(len(patterns))
+    indices = (offset + np.arange(samples)) % len(patterns)
+    values = patterns[indices].copy()
+    values[:, 0] = np.clip(values[:, 0] * rng.uniform(0.8, 1.2) + rng.normal(0, 0.3, samples), 0, 100)
+    values[:, 1] += rng.uniform(-5, 5) + rng.normal(0, 0.05, samples)
+    values[:, 2] += rng.normal(0, 0.005, samples)
+    return values
+
+async def seed(args: argparse.Namespace):
+    patterns = load_patterns(Path(args.source))
+    rng = np.random.default_rng(args.seed)
+    end = int(time.time()) // args.interval * args.interval
+    samples = args.days * 86400 // args.interval
+    timestamps = end - args.interval * np.arange(samples)[::-1]
+    conninfo = f"host={args.host} port={args.port} user={args.user} password={args.password}"
+    async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+        for i in range(args.sensors):
+            mac = seed_mac(i)
+            values = synthesize(patterns, samples, rng)
+            started = time.perf_counter()
+            async with conn.transaction():
+                await conn.execute("INSERT INTO sensors (mac) VALUES (%s) ON CONFLICT (mac) DO NOTHING", (mac,))
+                await conn.execute("DELETE FROM readings WHERE mac = %s", (mac,))
+                async with conn.cursor() as cur:
+                    async with cur.copy("COPY readings (mac, timestamp, humidity, temperature, battery) FROM STDIN") as copy:
+                        for chunk in range(0, samples, COPY_CHUNK_ROWS):
+                            rows = "".join(
+                                f"{mac}\t{ts}+00\t{h:.4f}\t{t:.4f}\t{b:.4f}\n"
+                                for ts, (h, t, b) in zip(
+                                    timestamps[chunk:chunk + COPY_CHUNK_ROWS].astype("datetime64[s]").astype(str),
+                                    values[chunk:chunk + COPY_CHUNK_ROWS]))
+                            await copy.write(rows)
+                h, t, b = values[-1]
+                await conn.execute("""
+                    INSERT INTO sensor_latest (mac, timestamp, humidity, temperature, battery)
+                    VALUES (%s, to_timestamp(%s), %s, %s, %s)
+                    ON CONFLICT (mac) DO UPDATE SET
+                        timestamp = excluded.timestamp, humidity = excluded.humidity,
+                        temperature = excluded.temperature, battery = excluded.battery
+                """, (mac, int(timestamps[-1]), float(h), float(t), float(b)))
+            print(f"{mac}: {samples} readings in {time.perf_counter() - started:.1f}s")
+        if not args.no_refresh:
+            # Materialize the rollups, like the refresh policies would eventually do
+            for view in ("readings_hourly", "readings_daily"):
+                started = time.perf_counter()
+                await conn.execute(f"CALL refresh_continuous_aggregate('{view}', NULL, NULL)")
+                print(f"{view} refreshed in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a GardenEye database with synthetic readings")
+    parser.add_argument("--sensors", type=int, default=20, help="Number of sensors to create")
+    parser.add_argument("--days", type=int, default=30, help="Days of history for each sensor")
+    parser.add_argument("--interval", type=int, default=SAMPLING_INTERVAL_S, help="Seconds between readings")
+    parser.add_argument("--source", default=str(SOURCE_CSV), help="CSV with the recorded patterns to replay")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--no-refresh", action="store_true", help="Don't refresh the continuous aggregates afterwards")
+    parser.add_argument("--host", default=DB_HOST)
+    parser.add_argument("--port", type=int, default=DB_PORT)
+    parser.add_argument("--user", default=DB_USER)
+    parser.add_argument("--password", default=DB_PASSWORD)
+    args = parser.parse_args()
+    asyncio.run(seed(args))
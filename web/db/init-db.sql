@@ -1,7 +1,9 @@
 create table sensors (
     mac varchar(17) primary key,
     name varchar(50) default null,
-    has_photo boolean default false
+    has_photo boolean default false,
+    photo_ext varchar(5) default null, -- extension of the uploaded photo, so it's found without listing the directory
+    photo_hash varchar(16) default null -- content hash of the uploaded photo, versions its URLs
 );
 
 create table readings (
@@ -19,6 +21,15 @@ WITH (
   timescaledb.chunk_interval='7d'
 );
 
+-- Latest reading of each sensor, kept up to date at ingest time
+create table sensor_latest (
+    mac varchar(17) primary key references sensors(mac) on delete cascade,
+    timestamp timestamptz not null,
+    humidity float default null,
+    temperature float default null,
+    battery float default null
+);
+
 create table settings (
   key text primary key,
   value text not null
@@ -28,6 +39,99 @@ insert into settings (key, value) values
   ('sync-time', '12:00'),
   ('battery-warning-threshold', '3.3'),
   ('battery-critical-threshold', '3.0'),
-  ('max-latency', '86400'); -- 1 day in seconds
+  ('max-latency', '86400'), -- 1 day in seconds
+  -- Days raw readings, hourly and daily rollups are kept for, 0 keeps them forever
+  ('raw-retention-days', '0'),
+  ('hourly-retention-days', '0'),
+  ('daily-retention-days', '0');
+
+-- Background jobs (heavy deletes), polled by the clients for their progress
+create table jobs (
+  id uuid primary key,
+  kind varchar(32) not null, -- delete_readings, delete_sensor
+  mac varchar(17) not null, -- no foreign key, the sensor may be the thing being deleted
+  status varchar(16) not null default 'queued', -- queued, running, done, failed
+  chunks_total integer default null,
+  chunks_done integer not null default 0,
+  rows_deleted bigint not null default 0,
+  error text default null,
+  created_at timestamptz not null default now(),
+  started_at timestamptz default null,
+  heartbeat_at timestamptz default null, -- running jobs without a recent heartbeat lost their worker and are claimed again
+  finished_at timestamptz default null
+);
+
+-- At most one active job per sensor and kind, even when submitted from different workers
+create unique index jobs_active on jobs (kind, mac) where status in ('queued', 'running');
+
+-- Sensor conditions, from when they start to when they end (null while active)
+create table alerts (
+  id bigserial primary key,
+  mac varchar(17) not null references sensors(mac) on delete cascade,
+  kind varchar(16) not null, -- offline, battery_low, battery_critical
+  started_at timestamptz not null,
+  ended_at timestamptz default null,
+  value float default null -- battery voltage that raised a battery alert
+);
+
+-- At most one active alert per sensor and kind, even when detected by different workers
+create unique index alerts_active on alerts (mac, kind) where ended_at is null;
+create index alerts_started_at on alerts (started_at desc);
+
+CALL add_columnstore_policy('readings', after => INTERVAL '7d');
+
+-- Rollups used by the readings endpoints for wide time windows.
+-- Real-time aggregation fills in the range that has not been materialized yet.
+create materialized view readings_hourly
+with (timescaledb.continuous, timescaledb.materialized_only = false) as
+select
+  mac,
+  time_bucket(interval '1 hour', timestamp) as bucket,
+  avg(humidity) as humidity_avg,
+  min(humidity) as humidity_min,
+  max(humidity) as humidity_max,
+  count(humidity) as humidity_count,
+  avg(temperature) as temperature_avg,
+  min(temperature) as temperature_min,
+  max(temperature) as temperature_max,
+  count(temperature) as temperature_count,
+  avg(battery) as battery_avg,
+  min(battery) as battery_min,
+  max(battery) as battery_max,
+  count(battery) as battery_count,
+  count(*) as samples
+from readings
+group by mac, bucket
+with no data;
+
+create materialized view readings_daily
+with (timescaledb.continuous, timescaledb.materialized_only = false) as
+select
+  mac,
+  time_bucket(interval '1 day', timestamp) as bucket,
+  avg(humidity) as humidity_avg,
+  min(humidity) as humidity_min,
+  max(humidity) as humidity_max,
+  count(humidity) as humidity_count,
+  avg(temperature) as temperature_avg,
+  min(temperature) as temperature_min,
+  max(temperature) as temperature_max,
+  count(temperature) as temperature_count,
+  avg(battery) as battery_avg,
+  min(battery) as battery_min,
+  max(battery) as battery_max,
+  count(battery) as battery_count,
+  count(*) as samples
+from readings
+group by mac, bucket
+with no data;
+
+select add_continuous_aggregate_policy('readings_hourly',
+  start_offset => interval '3 days',
+  end_offset => interval '1 hour',
+  schedule_interval => interval '30 minutes');
 
-CALL add_columnstore_policy('readings', after => INTERVAL '7d');
\ No newline at end of file
+select add_continuous_aggregate_policy('readings_daily',
+  start_offset => interval '7 days',
+  end_offset => interval '1 day',
+  schedule_interval => interval '1 hour');
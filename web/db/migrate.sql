@@ -0,0 +1,122 @@
+-- Brings a database created by an older init-db.sql up to date with it.
+-- Every statement is idempotent, so the script can be run again after each upgrade:
+--   docker exec -i <db container> psql -U <user> -v ON_ERROR_STOP=1 -f /migrate.sql
+-- Run it with psql's default autocommit, refreshing the rollups can't happen inside a transaction.
+
+alter table sensors add column if not exists photo_ext varchar(5) default null;
+alter table sensors add column if not exists photo_hash varchar(16) default null;
+
+create table if not exists sensor_latest (
+    mac varchar(17) primary key references sensors(mac) on delete cascade,
+    timestamp timestamptz not null,
+    humidity float default null,
+    temperature float default null,
+    battery float default null
+);
+
+-- Latest reading of every sensor, only moves a row forward in time like the ingest does
+insert into sensor_latest (mac, timestamp, humidity, temperature, battery)
+select distinct on (mac) mac, timestamp, humidity, temperature, battery
+from readings
+order by mac, timestamp desc
+on conflict (mac) do update set
+    timestamp = excluded.timestamp,
+    humidity = excluded.humidity,
+    temperature = excluded.temperature,
+    battery = excluded.battery
+where excluded.timestamp > sensor_latest.timestamp;
+
+insert into settings (key, value) values
+  ('raw-retention-days', '0'),
+  ('hourly-retention-days', '0'),
+  ('daily-retention-days', '0')
+on conflict (key) do nothing;
+
+create table if not exists jobs (
+  id uuid primary key,
+  kind varchar(32) not null,
+  mac varchar(17) not null,
+  status varchar(16) not null default 'queued',
+  chunks_total integer default null,
+  chunks_done integer not null default 0,
+  rows_deleted bigint not null default 0,
+  error text default null,
+  created_at timestamptz not null default now(),
+  started_at timestamptz default null,
+  heartbeat_at timestamptz default null,
+  finished_at timestamptz default null
+);
+alter table jobs add column if not exists heartbeat_at timestamptz default null;
+create unique index if not exists jobs_active on jobs (kind, mac) where status in ('queued', 'running');
+
+create table if not exists alerts (
+  id bigserial primary key,
+  mac varchar(17) not null references sensors(mac) on delete cascade,
+  kind varchar(16) not null,
+  started_at timestamptz not null,
+  ended_at timestamptz default null,
+  value float default null
+);
+create unique index if not exists alerts_active on alerts (mac, kind) where ended_at is null;
+create index if not exists alerts_started_at on alerts (started_at desc);
+
+create materialized view if not exists readings_hourly
+with (timescaledb.continuous, timescaledb.materialized_only = false) as
+select
+  mac,
+  time_bucket(interval '1 hour', timestamp) as bucket,
+  avg(humidity) as humidity_avg,
+  min(humidity) as humidity_min,
+  max(humidity) as humidity_max,
+  count(humidity) as humidity_count,
+  avg(temperature) as temperature_avg,
+  min(temperature) as temperature_min,
+  max(temperature) as temperature_max,
+  count(temperature) as temperature_count,
+  avg(battery) as battery_avg,
+  min(battery) as battery_min,
+  max(battery) as battery_max,
+  count(battery) as battery_count,
+  count(*) as samples
+from readings
+group by mac, bucket
+with no data;
+
+create materialized view if not exists readings_daily
+with (timescaledb.continuous, timescaledb.materialized_only = false) as
+select
+  mac,
+  time_bucket(interval '1 day', timestamp) as bucket,
+  avg(humidity) as humidity_avg,
+  min(humidity) as humidity_min,
+  max(humidity) as humidity_max,
+  count(humidity) as humidity_count,
+  avg(temperature) as temperature_avg,
+  min(temperature) as temperature_min,
+  max(temperature) as temperature_max,
+  count(temperature) as temperature_count,
+  avg(battery) as battery_avg,
+  min(battery) as battery_min,
+  max(battery) as battery_max,
+  count(battery) as battery_count,
+  count(*) as samples
+from readings
+group by mac, bucket
+with no data;
+
+select add_continuous_aggregate_policy('readings_hourly',
+  start_offset => interval '3 days',
+  end_offset => interval '1 hour',
+  schedule_interval => interval '30 minutes',
+  if_not_exists => true);
+
+select add_continuous_aggregate_policy('readings_daily',
+  start_offset => interval '7 days',
+  end_offset => interval '1 day',
+  schedule_interval => interval '1 hour',
+  if_not_exists => true);
+
+-- The policies only cover the last few days, the history is materialized once here.
+-- Ranges already materialized and not modified since are skipped, so running this again is cheap.
+call refresh_continuous_aggregate('readings_hourly', null, now() - interval '1 hour');
+call refresh_continuous_aggregate('readings_daily', null, now() - interval '1 day');
@@ -0,0 +1,18 @@
+export interface Job {
+  id: string
+  kind: 'delete_readings' | 'delete_sensor'
+  mac: string
+  status: 'queued' | 'running' | 'done' | 'failed'
+  chunks_total?: number
+  chunks_done: number
+  rows_deleted: number
+  error?: string
+  created_at: number
+  started_at?: number
+  finished_at?: number
+}
+
+export interface JobAccepted {
+  job_id: string
+  status_url: string
+}
@@ -3,10 +3,31 @@ export interface Readings {
   humidity: number[]
   temperature: number[]
   battery: number[]
+  battery_percent?: (number | null)[]
   now: number
 }
 
+export interface ExtendedReadings extends Readings {
+  humidity_min: (number | null)[]
+  humidity_max: (number | null)[]
+  temperature_min: (number | null)[]
+  temperature_max: (number | null)[]
+  battery_min: (number | null)[]
+  battery_max: (number | null)[]
+  samples: number[]
+}
+
 export interface SensorReadings extends Readings {
   mac: string
   name?: string
 }
+
+export interface BatchReadings {
+  sensors: string[]
+  timestamps: number[]
+  humidity: (number | null)[][]
+  temperature: (number | null)[][]
+  battery: (number | null)[][]
+  battery_percent: (number | null)[][]
+  now: number
+}
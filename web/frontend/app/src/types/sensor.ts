@@ -9,6 +9,9 @@ export interface Sensor {
   mac: string
   name?: string
   has_photo: boolean
+  photo_hash?: string
   online: boolean
   latest_reading?: LatestReading
+  battery_percent?: number
+  battery_time_to_empty?: number // seconds
 }
\ No newline at end of file
@@ -3,4 +3,7 @@ export interface GlobalSettings {
   battery_warning_threshold: number
   battery_critical_threshold: number
   max_latency: number
+  raw_retention_days: number
+  hourly_retention_days: number
+  daily_retention_days: number
 }
\ No newline at end of file